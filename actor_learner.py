@@ -0,0 +1,221 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import queue
+import time
+from copy import deepcopy
+import numpy as np
+import torch
+import torch.multiprocessing as mp
+from deal_corpus import pack_deals
+from dqn_agent import Agent, choose_actions
+from replay_memory import Prefetcher, SharedReplayBuffer, SharedReplaySegment
+from vector_env import VectorEnv
+
+"""
+Actor/learner training. Several actor processes play episodes on a VectorEnv
+each, choosing their moves with a copy of the network on the CPU, and write
+their experiences to their own segment of a replay memory in shared memory. The
+learner (the calling process) samples batches from all the segments and trains
+the network of the agent continuously, copying its weights to the actors every
+`sync_interval` gradient steps.
+
+Every actor explores with a fixed epsilon, from `max_epsilon` for the first one
+down to `min_epsilon` for the last one, so the memory always holds both
+exploratory and greedy episodes.
+"""
+
+# Boards played at once by every actor
+envs_per_actor = 16
+# Gradient steps of the learner between copies of the network to the actors
+sync_interval = 100
+# Moves played by the actors between reads of the shared network
+actor_sync_interval = 50
+
+max_epsilon = 0.4
+min_epsilon = 0.01
+
+
+class StridedDeals:
+    """Deals i, i + step, i + 2 * step... of a sequence of deals, so that
+    every actor plays different deals."""
+
+    def __init__(self, deals, start: int, step: int):
+        self.deals = deals
+        self.indices = range(start, len(deals), step)
+
+    def __len__(self):
+        return len(self.indices)
+
+    def __getitem__(self, index: int):
+        return self.deals[self.indices[index]]
+
+
+def actor_epsilon(index: int, n_actors: int):
+    """Returns the epsilon of the actor with the given index."""
+    if n_actors == 1:
+        return max_epsilon
+
+    fraction = index / (n_actors - 1)
+    return max_epsilon * (min_epsilon / max_epsilon) ** fraction
+
+
+def run_actor(
+    segment, shared_network, lock, episodes, stop, deals, n_envs, epsilon, seed
+):
+    """Plays episodes and writes their experiences to the given segment until
+    `stop` is set. Runs in the actor processes."""
+    # The actors share the CPUs with each other
+    torch.set_num_threads(1)
+
+    # Don't wait for the learner to read the last episodes before exiting
+    episodes.cancel_join_thread()
+
+    network = deepcopy(shared_network)
+    network.eval()
+
+    rng = np.random.default_rng(seed)
+    envs = VectorEnv(n_envs, deals)
+
+    steps = 0
+    while not stop.is_set():
+        if steps % actor_sync_interval == 0:
+            with lock:
+                network.load_state_dict(shared_network.state_dict())
+
+        states = envs.observations.copy()
+        actions = choose_actions(network, states, epsilon, rng)
+        next_states, rewards, dones, _ = envs.step(actions)
+
+        for i in range(n_envs):
+            segment.add(
+                states[i], actions[i], rewards[i], next_states[i], dones[i], stream=i
+            )
+
+        for score, won in envs.pop_finished():
+            episodes.put((score, won))
+
+        steps += 1
+
+    segment.close()
+
+
+def train(
+    agent: Agent,
+    n_actors: int,
+    boards,
+    num_episodes: int,
+    on_episode,
+    n_envs: int = envs_per_actor,
+):
+    """Trains the agent with `n_actors` actor processes (playing `n_envs`
+    boards at once each), until `num_episodes` episodes have been played or
+    `on_episode` (called with the score of every finished episode and whether
+    it was won) returns True. The boards are played in order, spread among the
+    actors, or random deals are played if no boards are given."""
+    if agent.prioritized:
+        raise ValueError("Prioritized replay can't be used with actors")
+
+    # The actors are forked, as spawned processes would run the training
+    # script (rl_train.py has no main guard) again. They only use the CPU, so
+    # it's safe even if the learner has initialized CUDA
+    context = mp.get_context("fork")
+
+    segments = [
+        SharedReplaySegment(
+            agent.action_size,
+            agent.buffer_size // n_actors,
+            agent.batch_size,
+            agent.rng.integers(2**31),
+        )
+        for _ in range(n_actors)
+    ]
+    memory = SharedReplayBuffer(
+        segments, agent.batch_size, agent.rng.integers(2**31), agent.state_format
+    )
+
+    shared_network = deepcopy(agent.network).cpu()
+    shared_network.share_memory()
+
+    lock = context.Lock()
+    episodes = context.Queue()
+    stop = context.Event()
+
+    deals = pack_deals(boards) if boards is not None else None
+    actors = [
+        context.Process(
+            target=run_actor,
+            args=(
+                segments[i],
+                shared_network,
+                lock,
+                episodes,
+                stop,
+                StridedDeals(deals, i, n_actors) if deals is not None else None,
+                n_envs,
+                actor_epsilon(i, n_actors),
+                agent.rng.integers(2**31),
+            ),
+            daemon=True,
+        )
+        for i in range(n_actors)
+    ]
+
+    for actor in actors:
+        actor.start()
+
+    # Started after forking the actors, which must not inherit its thread
+    prefetcher = Prefetcher(memory, agent.prefetch) if agent.prefetch > 0 else None
+
+    try:
+        finished = 0
+        learn_steps = 0
+
+        while finished < num_episodes:
+            try:
+                while True:
+                    score, won = episodes.get_nowait()
+                    finished += 1
+                    if on_episode(score, won) or finished >= num_episodes:
+                        return
+            except queue.Empty:
+                pass
+
+            if len(memory) <= agent.batch_size:
+                time.sleep(0.01)
+                continue
+
+            batch = prefetcher.get() if prefetcher is not None else memory.sample()
+            agent.learn(batch, agent.gamma)
+            learn_steps += 1
+
+            if learn_steps % sync_interval == 0:
+                with lock:
+                    shared_network.load_state_dict(agent.network.state_dict())
+    finally:
+        if prefetcher is not None:
+            prefetcher.close()
+
+        stop.set()
+        for actor in actors:
+            actor.join(timeout=10)
+            if actor.is_alive():
+                actor.terminate()
+
+        for segment in segments:
+            segment.close(unlink=True)
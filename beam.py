@@ -0,0 +1,148 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from copy import deepcopy
+from solitaire_board import SolitaireBoard
+from dfs import get_search_moves
+from bfs import STATE_SIZE, STATE_PADDING, pack_state
+
+# Weights of the features returned by `layer_features`: cards in the
+# foundations, hidden cards in the tableau, empty columns, cards in the stock
+# and waste, and face-up cards in the tableau
+default_weights = np.array([10.0, -4.0, 2.0, -0.5, 1.0])
+
+
+def layer_features(states: np.ndarray):
+    """Computes the features of a whole layer of positions at once. `states` is
+    an array of shape (n, STATE_SIZE) holding the padded compact records of the
+    boards (see `bfs.pack_state`). Returns an array of shape (n, 5)."""
+    n = states.shape[0]
+    rows = np.arange(n)
+
+    is_card_or_length = states != STATE_PADDING
+    is_hidden = is_card_or_length & ((states & 0x40) != 0)
+
+    # Every record has 13 length bytes (stock, waste, foundations and columns),
+    # so the rest of its bytes are the cards that are not in the foundations
+    foundation_cards = 52 - (is_card_or_length.sum(axis=1) - 13)
+    hidden_cards = is_hidden.sum(axis=1)
+
+    stock_len = states[:, 0].astype(np.int64)
+    waste_len = states[rows, 1 + stock_len].astype(np.int64)
+    stock_waste_cards = stock_len + waste_len
+
+    # Walk the column lengths of every record in lockstep
+    pos = 2 + stock_len + waste_len + 4
+    empty_columns = np.zeros(n, dtype=np.int64)
+    for _ in range(7):
+        col_len = states[rows, pos].astype(np.int64)
+        empty_columns += col_len == 0
+        pos += 1 + col_len
+
+    face_up_cards = 52 - foundation_cards - stock_waste_cards - hidden_cards
+
+    return np.stack(
+        [
+            foundation_cards,
+            hidden_cards,
+            empty_columns,
+            stock_waste_cards,
+            face_up_cards,
+        ],
+        axis=1,
+    ).astype(np.float64)
+
+
+def beam_search(
+    start_node: SolitaireBoard,
+    width: int = 1000,
+    max_depth: int = 300,
+    weights: np.ndarray = default_weights,
+    on_progress=None,
+):
+    """Traverses through the possible moves for a given SolitaireBoard using
+    beam search. Every layer is expanded completely, scored at once with
+    `layer_features` and `weights`, and only the `width` best positions not
+    seen before are kept, so the cost of the search is bounded by
+    `width * max_depth` expansions. Only the kept positions are remembered to
+    detect duplicates, so memory is bounded by `width * max_depth` too. Move
+    order and tie-breaking are fixed, so the search is deterministic.
+
+    Returns the moves of the solution found (or None if there is none) and the
+    number of positions generated. If given, `on_progress` is called with the
+    number of positions and the current board every 100 positions."""
+
+    if start_node.check_if_won():
+        return [], 1
+
+    beam = [start_node]
+    # Positions kept in the beam of any layer
+    seen = {pack_state(start_node)}
+    generated = 1
+
+    # For every layer, the index of the parent of each position in the
+    # previous layer and the move that leads to it
+    links = []
+
+    for depth in range(1, max_depth + 1):
+        children = []
+        states = []
+        layer_links = []
+        layer_seen = set()
+
+        for parent_index, board in enumerate(beam):
+            for move in get_search_moves(board):
+                new_node = deepcopy(board)
+                new_node.play_move(move)
+
+                if new_node.check_if_won():
+                    winning_moves = [move]
+                    index = parent_index
+                    for layer in reversed(links):
+                        index, prev_move = layer[index]
+                        winning_moves.append(prev_move)
+                    winning_moves.reverse()
+
+                    return winning_moves, generated
+
+                state = pack_state(new_node)
+                if state in seen or state in layer_seen:
+                    continue
+                layer_seen.add(state)
+                generated += 1
+
+                if on_progress is not None and generated % 100 == 0:
+                    on_progress(generated, new_node)
+
+                children.append(new_node)
+                states.append(state)
+                layer_links.append((parent_index, move))
+
+        if len(children) == 0:
+            return None, generated
+
+        layer = np.frombuffer(b"".join(states), dtype=np.uint8)
+        scores = layer_features(layer.reshape(-1, STATE_SIZE)) @ weights
+        best = np.argsort(-scores, kind="stable")[:width]
+
+        beam = [children[i] for i in best]
+        links.append([layer_links[i] for i in best])
+        seen.update(states[i] for i in best)
+
+    return None, generated
@@ -0,0 +1,284 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import random
+import sys
+import time
+from copy import deepcopy
+from legal_moves import LegalMoveChecker
+from solitaire_board import SolitaireBoard
+
+"""
+Micro-benchmarks of the engine: the operations of `SolitaireBoard` and
+`LegalMoveChecker` that the solvers and the agent call on every node.
+
+Every benchmark runs over the same set of positions, taken from random games
+played from numbered deals with a seeded generator, so runs with the same
+settings measure exactly the same work. The results are written as JSON, and
+can be compared against the results of a previous run (a baseline) to find
+the operations that got slower.
+"""
+
+n_deals = 20
+n_plies = 40
+seed = 0
+repeat = 5
+
+# Slowdown (as a fraction of the baseline time) reported as a regression
+regression_threshold = 0.1
+
+
+def make_positions(n_deals: int, n_plies: int, seed: int):
+    """Plays a random game of up to `n_plies` moves from each of the first
+    `n_deals` numbered deals, returning every position reached along with a
+    legal move of it (positions without legal moves are skipped)."""
+    rng = random.Random(seed)
+    ret = []
+
+    for number in range(n_deals):
+        board = SolitaireBoard.generate_from_number(number)
+
+        for _ in range(n_plies):
+            legal_moves = LegalMoveChecker(board).get_legal_moves()
+            if len(legal_moves) == 0:
+                break
+
+            move = rng.choice(legal_moves)
+            ret.append((deepcopy(board), move))
+            board.play_move(move)
+
+    return ret
+
+
+def copy_boards(positions):
+    return [(deepcopy(board), move) for board, move in positions]
+
+
+def bench_play_move(positions):
+    boards = copy_boards(positions)
+    start = time.perf_counter()
+    for board, move in boards:
+        board.play_move(move)
+    return time.perf_counter() - start
+
+
+def bench_play_move_reward(positions):
+    boards = copy_boards(positions)
+    start = time.perf_counter()
+    for board, move in boards:
+        board.play_move_reward(move)
+    return time.perf_counter() - start
+
+
+def bench_encode_board(positions):
+    start = time.perf_counter()
+    for board, _ in positions:
+        board.encode_board()
+    return time.perf_counter() - start
+
+
+def bench_export(positions):
+    start = time.perf_counter()
+    for board, _ in positions:
+        board.export()
+    return time.perf_counter() - start
+
+
+def bench_generate_from_json(positions):
+    exported = [board.export() for board, _ in positions]
+    start = time.perf_counter()
+    for data in exported:
+        SolitaireBoard.generate_from_json(data)
+    return time.perf_counter() - start
+
+
+def bench_deepcopy(positions):
+    start = time.perf_counter()
+    for board, _ in positions:
+        deepcopy(board)
+    return time.perf_counter() - start
+
+
+def bench_checker(method: str):
+    """Returns a benchmark of the given method of `LegalMoveChecker`."""
+
+    def bench(positions):
+        checkers = [LegalMoveChecker(board) for board, _ in positions]
+        start = time.perf_counter()
+        for checker in checkers:
+            getattr(checker, method)()
+        return time.perf_counter() - start
+
+    return bench
+
+
+benchmarks = {
+    "play_move": bench_play_move,
+    "play_move_reward": bench_play_move_reward,
+    "encode_board": bench_encode_board,
+    "export": bench_export,
+    "generate_from_json": bench_generate_from_json,
+    "deepcopy": bench_deepcopy,
+    "check_f_moves": bench_checker("check_f_moves"),
+    "check_w_moves": bench_checker("check_w_moves"),
+    "check_d_moves": bench_checker("check_d_moves"),
+    "check_s_moves": bench_checker("check_s_moves"),
+    "check_m_moves": bench_checker("check_m_moves"),
+    "get_legal_moves": bench_checker("get_legal_moves"),
+    "encode_legal_moves": bench_checker("encode_legal_moves"),
+}
+
+
+def run_benchmarks(positions, names, repeat: int):
+    """Runs the given benchmarks `repeat` times over the positions, returning
+    the best time of each one in microseconds per call."""
+    ret = {}
+
+    for name in names:
+        best = min(benchmarks[name](positions) for _ in range(repeat))
+        ret[name] = best / len(positions) * 1e6
+
+    return ret
+
+
+def compare(results: dict, baseline: dict, threshold: float):
+    """Prints the results next to the ones of the baseline. Returns the names
+    of the benchmarks that are slower than the baseline by more than
+    `threshold` (a fraction of the baseline time)."""
+    regressions = []
+
+    print(f"{'benchmark':<20} {'baseline':>10} {'current':>10} {'change':>8}")
+    for name, current in results.items():
+        if name not in baseline:
+            print(f"{name:<20} {'-':>10} {current:>10.2f} {'-':>8}")
+            continue
+
+        change = (current - baseline[name]) / baseline[name]
+        flag = ""
+        if change > threshold:
+            regressions.append(name)
+            flag = "  REGRESSION"
+
+        print(
+            f"{name:<20} {baseline[name]:>10.2f} {current:>10.2f} "
+            f"{change:>+8.1%}{flag}"
+        )
+
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks the game engine")
+    parser.add_argument(
+        "--output", default=None, help="JSON file where the results are written"
+    )
+    parser.add_argument(
+        "--compare",
+        default=None,
+        help="JSON file with the results of a previous run to compare with",
+    )
+    parser.add_argument(
+        "--threshold",
+        type=float,
+        default=regression_threshold,
+        help="slowdown reported as a regression, as a fraction of the baseline "
+        "time (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--deals",
+        type=int,
+        default=n_deals,
+        help="number of deals the positions are taken from (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--plies",
+        type=int,
+        default=n_plies,
+        help="moves played from every deal (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--seed",
+        type=int,
+        default=seed,
+        help="seed of the random games (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--repeat",
+        type=int,
+        default=repeat,
+        help="runs of every benchmark, keeping the best one (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--only",
+        default=None,
+        help="comma-separated benchmarks to run (default: all of them)",
+    )
+    args = parser.parse_args()
+
+    names = args.only.split(",") if args.only else list(benchmarks)
+    for name in names:
+        if name not in benchmarks:
+            parser.error(f"invalid benchmark {name}")
+
+    baseline = None
+    if args.compare is not None:
+        with open(args.compare, "r") as f:
+            baseline = json.load(f)
+
+        settings = (args.deals, args.plies, args.seed)
+        if settings != tuple(baseline[k] for k in ("deals", "plies", "seed")):
+            print(
+                "Warning: the baseline was run on a different set of positions",
+                file=sys.stderr,
+            )
+
+    positions = make_positions(args.deals, args.plies, args.seed)
+    results = run_benchmarks(positions, names, args.repeat)
+
+    output = {
+        "deals": args.deals,
+        "plies": args.plies,
+        "seed": args.seed,
+        "positions": len(positions),
+        "repeat": args.repeat,
+        "python": sys.version.split()[0],
+        "results": results,
+    }
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(output, f, indent=2)
+
+    if baseline is None:
+        print(f"{'benchmark':<20} {'us/call':>10}")
+        for name, value in results.items():
+            print(f"{name:<20} {value:>10.2f}")
+        return
+
+    regressions = compare(results, baseline["results"], args.threshold)
+    if regressions:
+        print("Regressions:", ", ".join(regressions))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
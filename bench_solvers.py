@@ -0,0 +1,310 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import dataclasses
+import json
+import math
+import os
+import resource
+from multiprocessing import Pool
+from deal_corpus import parse_deal_range
+from solitaire_board import SolitaireBoard
+from solver import SolveConfig, solve
+
+"""
+Benchmark of solver configurations over fixed sets of numbered deals.
+
+The deals are split in three tiers by how hard they are for a reference DFS
+(`classify`): easy deals are solved within `easy_nodes` nodes, medium deals
+within `classify_max_nodes` nodes, and hard deals are not solved. The tiers are
+saved to a JSON file, so every benchmark run (`run`) solves the same deals.
+
+For every configuration and tier, the benchmark reports the solve rate, the
+nodes expanded, the nodes per second, the 50th, 90th and 99th percentiles of
+the wall time per deal and the peak memory (RSS) of the worker processes, as
+JSON and as Markdown tables with the configurations side by side.
+"""
+
+default_tiers = "boards/tiers.json"
+
+classify_max_nodes = 10_000
+easy_nodes = 1_000
+tier_names = ["easy", "medium", "hard"]
+
+# Configurations benchmarked if no file is given, as the fields of their
+# `SolveConfig` (seeded, so every run expands the same nodes)
+default_configs = {
+    "dfs": {"solver": "dfs", "seed": 0},
+    "dfs-50k": {"solver": "dfs", "seed": 0, "max_nodes": 50_000},
+    "beam": {"solver": "beam"},
+    "mcts-2s": {"solver": "mcts", "time_budget": 2.0},
+}
+
+config_fields = {
+    field.name
+    for field in dataclasses.fields(SolveConfig)
+    if field.name not in ("on_progress", "on_solution")
+}
+
+# Configuration of the pool workers, set by `set_config` when the pool starts
+bench_config = None
+
+
+def set_config(config: SolveConfig):
+    global bench_config
+    bench_config = config
+
+
+def run_deal(number: int):
+    """Solves the numbered deal with the configuration of the worker, returning
+    whether it was solved, the nodes expanded, the wall time and the peak RSS of
+    the worker (in KiB)."""
+    board = SolitaireBoard.generate_from_number(number)
+    result = solve(board, bench_config)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+    return result.solved, result.nodes, result.elapsed, rss
+
+
+def make_config(fields: dict):
+    """Builds a SolveConfig from the fields given in a configurations file."""
+    invalid = set(fields) - config_fields
+    if invalid:
+        raise ValueError(f"Invalid config fields {sorted(invalid)}")
+
+    return SolveConfig(**fields)
+
+
+def percentile(values: list, p: float):
+    """Returns the p-th percentile of the values (nearest rank)."""
+    values = sorted(values)
+    rank = max(1, math.ceil(p / 100 * len(values)))
+    return values[rank - 1]
+
+
+def summarize(results: list):
+    """Returns the metrics of a configuration over the results of a tier."""
+    times = [elapsed for _, _, elapsed, _ in results]
+    nodes = sum(n for _, n, _, _ in results)
+    total_time = sum(times)
+
+    return {
+        "deals": len(results),
+        "solve_rate": sum(1 for solved, *_ in results if solved) / len(results),
+        "mean_nodes": nodes / len(results),
+        "nodes_per_second": nodes / total_time if total_time > 0 else 0.0,
+        "p50": percentile(times, 50),
+        "p90": percentile(times, 90),
+        "p99": percentile(times, 99),
+        "peak_rss_mib": max(rss for *_, rss in results) / 1024,
+    }
+
+
+def run_config(config: SolveConfig, tiers: dict, processes: int | None):
+    """Solves the deals of every tier with the given configuration, returning
+    the metrics of each tier. A new pool is used for every configuration, so
+    the peak RSS only includes its own work."""
+    ret = {}
+
+    with Pool(processes, initializer=set_config, initargs=(config,)) as p:
+        for tier in tier_names:
+            if not tiers.get(tier):
+                continue
+
+            ret[tier] = summarize(p.map(run_deal, tiers[tier], chunksize=1))
+
+    return ret
+
+
+def classify_deal(number: int):
+    """Returns the tier of the numbered deal. Runs in the pool workers."""
+    board = SolitaireBoard.generate_from_number(number)
+    result = solve(board, SolveConfig(seed=0, max_nodes=classify_max_nodes))
+
+    if not result.solved:
+        return "hard"
+
+    return "easy" if result.nodes <= easy_nodes else "medium"
+
+
+def classify(numbers, per_tier: int | None, processes: int | None):
+    """Splits the numbered deals in tiers, keeping at most `per_tier` deals in
+    each one."""
+    tiers = {tier: [] for tier in tier_names}
+
+    with Pool(processes) as p:
+        for number, tier in zip(numbers, p.imap(classify_deal, numbers)):
+            if per_tier is None or len(tiers[tier]) < per_tier:
+                tiers[tier].append(number)
+
+    return tiers
+
+
+metric_columns = [
+    ("solve_rate", "Solve rate", "{:.1%}"),
+    ("mean_nodes", "Nodes", "{:.0f}"),
+    ("nodes_per_second", "Nodes/s", "{:.0f}"),
+    ("p50", "p50 (s)", "{:.3f}"),
+    ("p90", "p90 (s)", "{:.3f}"),
+    ("p99", "p99 (s)", "{:.3f}"),
+    ("peak_rss_mib", "Peak RSS (MiB)", "{:.1f}"),
+]
+
+
+def format_tables(results: dict):
+    """Returns a Markdown table per tier, with a row per configuration."""
+    lines = []
+
+    for tier in tier_names:
+        rows = [(name, tiers[tier]) for name, tiers in results.items() if tier in tiers]
+        if not rows:
+            continue
+
+        deals = rows[0][1]["deals"]
+        lines.append(f"### {tier} ({deals} deals)")
+        lines.append("")
+        titles = [title for _, title, _ in metric_columns]
+        lines.append("| Configuration | " + " | ".join(titles) + " |")
+        lines.append("|---" * (len(metric_columns) + 1) + "|")
+
+        for name, metrics in rows:
+            values = [fmt.format(metrics[key]) for key, _, fmt in metric_columns]
+            lines.append(f"| {name} | " + " | ".join(values) + " |")
+
+        lines.append("")
+
+    return "\n".join(lines)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks solver configurations")
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="number of worker processes (default: one per CPU)",
+    )
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    classify_parser = commands.add_parser(
+        "classify", help="split numbered deals in difficulty tiers"
+    )
+    classify_parser.add_argument(
+        "--deals",
+        default="0:1000",
+        help="range of numbered deals to classify (default: %(default)s)",
+    )
+    classify_parser.add_argument(
+        "--per-tier",
+        type=int,
+        default=None,
+        help="maximum number of deals kept in every tier",
+    )
+    classify_parser.add_argument(
+        "--output",
+        default=default_tiers,
+        help="JSON file where the tiers are written (default: %(default)s)",
+    )
+
+    run_parser = commands.add_parser("run", help="benchmark solver configurations")
+    run_parser.add_argument(
+        "--tiers",
+        default=default_tiers,
+        help="JSON file written by classify (default: %(default)s)",
+    )
+    run_parser.add_argument(
+        "--configs",
+        default=None,
+        help="JSON file with an object from the name of every configuration to "
+        "its SolveConfig fields (default: a few standard configurations)",
+    )
+    run_parser.add_argument(
+        "--only",
+        default=None,
+        help="comma-separated tiers to run (default: all of them)",
+    )
+    run_parser.add_argument(
+        "--output", default=None, help="JSON file where the results are written"
+    )
+    run_parser.add_argument(
+        "--table", default=None, help="Markdown file where the tables are written"
+    )
+    args = parser.parse_args()
+
+    if args.command == "classify":
+        try:
+            numbers = parse_deal_range(args.deals).numbers
+        except ValueError as e:
+            parser.error(str(e))
+
+        tiers = classify(numbers, args.per_tier, args.processes)
+
+        directory = os.path.dirname(args.output)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(args.output, "w") as f:
+            json.dump(tiers, f)
+
+        for tier in tier_names:
+            print(f"{tier}: {len(tiers[tier])} deals")
+        return
+
+    with open(args.tiers, "r") as f:
+        tiers = json.load(f)
+
+    if args.only is not None:
+        only = args.only.split(",")
+        for tier in only:
+            if tier not in tier_names:
+                parser.error(f"invalid tier {tier}")
+        tiers = {tier: deals for tier, deals in tiers.items() if tier in only}
+
+    configs_json = default_configs
+    if args.configs is not None:
+        with open(args.configs, "r") as f:
+            configs_json = json.load(f)
+
+    try:
+        configs = {name: make_config(fields) for name, fields in configs_json.items()}
+    except (TypeError, ValueError) as e:
+        parser.error(str(e))
+
+    results = {}
+    for name, config in configs.items():
+        print(f"Running {name}...")
+        results[name] = run_config(config, tiers, args.processes)
+
+    tables = format_tables(results)
+    print()
+    print(tables)
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump({"configs": configs_json, "results": results}, f, indent=2)
+
+    if args.table is not None:
+        with open(args.table, "w") as f:
+            f.write(tables)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,229 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import heapq
+import os
+import shutil
+import struct
+import tempfile
+from copy import deepcopy
+from legal_moves import LegalMoveChecker
+from solitaire_board import SolitaireBoard
+from dfs import get_search_moves
+
+# Every position is stored as the output of `SolitaireBoard.export_compact`,
+# padded to a fixed size so that records can be sorted and addressed by index
+STATE_SIZE = 66
+STATE_PADDING = 0xFF
+
+# A layer record is the padded position, the index of its parent in the
+# previous layer and the index of the move (in the action table of
+# `LegalMoveChecker`) that leads from the parent to it
+LINK = struct.Struct("<IH")
+RECORD_SIZE = STATE_SIZE + LINK.size
+
+NO_PARENT = 0xFFFFFFFF
+NO_MOVE = 0xFFFF
+
+
+def pack_state(board: SolitaireBoard):
+    """Returns the fixed-size compact record of a board."""
+    state = board.export_compact()
+    return state + bytes([STATE_PADDING]) * (STATE_SIZE - len(state))
+
+
+def layer_path(workdir: str, depth: int):
+    return os.path.join(workdir, f"layer-{depth}.bin")
+
+
+def read_records(path: str, size: int):
+    """Yields the fixed-size records stored in the given file, in order."""
+    with open(path, "rb") as f:
+        while True:
+            chunk = f.read(size * 4096)
+            if not chunk:
+                break
+
+            for i in range(0, len(chunk), size):
+                yield chunk[i : i + size]
+
+
+def write_records(path: str, records):
+    """Writes the given records to a file, returning how many were written."""
+    count = 0
+    with open(path, "wb") as f:
+        for record in records:
+            f.write(record)
+            count += 1
+
+    return count
+
+
+def unique_unseen(records, seen_path: str):
+    """Filters a sorted stream of layer records, keeping only the first record
+    of every position and dropping the positions found in the (sorted) file of
+    already seen states. This is the duplicate detection step of the search,
+    done by merging sorted runs instead of keeping a hash set in memory."""
+    seen = read_records(seen_path, STATE_SIZE)
+    seen_state = next(seen, None)
+    last_state = None
+
+    for record in records:
+        state = record[:STATE_SIZE]
+        if state == last_state:
+            continue
+        last_state = state
+
+        while seen_state is not None and seen_state < state:
+            seen_state = next(seen, None)
+
+        if seen_state == state:
+            continue
+
+        yield record
+
+
+def trace_moves(workdir: str, depth: int, index: int, moves_table):
+    """Follows the parent links from a record back to the root, returning the
+    moves that lead from the initial board to it."""
+    moves = []
+
+    while depth > 0:
+        with open(layer_path(workdir, depth), "rb") as f:
+            f.seek(index * RECORD_SIZE)
+            record = f.read(RECORD_SIZE)
+
+        index, move = LINK.unpack(record[STATE_SIZE:])
+        moves.append(moves_table.decode_move(move))
+        depth -= 1
+
+    moves.reverse()
+    return moves
+
+
+def bfs_search(
+    start_node: SolitaireBoard,
+    max_depth: int = 150,
+    workdir: str | None = None,
+    run_size: int = 1_000_000,
+    on_progress=None,
+):
+    """Traverses through the possible moves for a given SolitaireBoard using a
+    layered breadth-first search, so the first solution found is one of minimal
+    length.
+
+    Each depth layer is kept on disk as a sorted file of compact position
+    records. Children are generated into sorted runs of at most `run_size`
+    records, and duplicates (both within the layer and against every previous
+    layer) are removed by merging those runs with the file of seen states, so
+    memory use is bounded by `run_size` regardless of the size of the search.
+    The layers are written to a temporary directory created inside `workdir`.
+
+    Returns the moves of the solution found (or None if there is none) and the
+    number of positions stored. If given, `on_progress` is called with the
+    number of positions and the current board every 100 expanded positions."""
+
+    workdir = tempfile.mkdtemp(prefix="bfs-", dir=workdir)
+    nodes = 1
+    expanded = 0
+    moves_table = LegalMoveChecker(start_node)
+
+    try:
+        start_state = pack_state(start_node)
+        write_records(
+            layer_path(workdir, 0), [start_state + LINK.pack(NO_PARENT, NO_MOVE)]
+        )
+
+        seen_path = os.path.join(workdir, "seen.bin")
+        write_records(seen_path, [start_state])
+
+        if start_node.check_if_won():
+            return [], nodes
+
+        for depth in range(1, max_depth + 1):
+            runs = []
+            buffer = []
+
+            def flush_run():
+                buffer.sort(key=lambda record: record[:STATE_SIZE])
+                path = os.path.join(workdir, f"run-{len(runs)}.bin")
+                write_records(path, buffer)
+                runs.append(path)
+                buffer.clear()
+
+            parents = read_records(layer_path(workdir, depth - 1), RECORD_SIZE)
+            for parent_index, record in enumerate(parents):
+                board = SolitaireBoard.generate_from_compact(record[:STATE_SIZE])
+
+                if on_progress is not None and expanded % 100 == 0:
+                    on_progress(nodes, board)
+                expanded += 1
+
+                for move in get_search_moves(board):
+                    new_node = deepcopy(board)
+                    new_node.play_move(move)
+
+                    link = LINK.pack(parent_index, moves_table.encode_move(move))
+
+                    if new_node.check_if_won():
+                        winning_moves = trace_moves(
+                            workdir, depth - 1, parent_index, moves_table
+                        )
+                        winning_moves.append(move)
+
+                        return winning_moves, nodes
+
+                    buffer.append(pack_state(new_node) + link)
+                    if len(buffer) >= run_size:
+                        flush_run()
+
+            if buffer:
+                flush_run()
+
+            merged = heapq.merge(
+                *[read_records(path, RECORD_SIZE) for path in runs],
+                key=lambda record: record[:STATE_SIZE],
+            )
+            layer_size = write_records(
+                layer_path(workdir, depth), unique_unseen(merged, seen_path)
+            )
+
+            for path in runs:
+                os.remove(path)
+
+            nodes += layer_size
+
+            # No new positions, so there is no solution
+            if layer_size == 0:
+                return None, nodes
+
+            # Add the new layer to the sorted file of seen states
+            new_seen_path = os.path.join(workdir, "seen-new.bin")
+            new_states = (
+                record[:STATE_SIZE]
+                for record in read_records(layer_path(workdir, depth), RECORD_SIZE)
+            )
+            write_records(
+                new_seen_path,
+                heapq.merge(read_records(seen_path, STATE_SIZE), new_states),
+            )
+            os.replace(new_seen_path, seen_path)
+
+        return None, nodes
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
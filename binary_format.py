@@ -0,0 +1,363 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import struct
+import sys
+from card import Card
+from legal_moves import LegalMoveChecker
+from solitaire_board import SolitaireBoard
+
+"""
+Compact binary format for deals and solutions.
+
+A deal is stored in DEAL_SIZE bytes: the index in the deck (see `Card.compact`)
+of the 52 cards, pile by pile (stock, waste, the foundations in the order of
+`Card.suits` and the tableau columns), a 52-bit mask with the hidden cards
+(bit i is set if the i-th card of the permutation is hidden) and the length of
+each of the 13 piles. The lengths are needed to store positions in the middle
+of a game; initial deals (the boards of `SolitaireBoard.generate_random`) have
+fixed lengths, so they can also be stored as an INITIAL_DEAL_SIZE bytes record
+with only the permutation and the mask.
+
+A solution is stored as a deal, the length of its moves and the moves. Every
+move is an index in the action table of `LegalMoveChecker`:
+
+- 0x00-0x7F: first byte of a move within the tableau, stored in two bytes as
+  its big-endian index in the action table
+- 0x80-0xBF: any other move, as 0x80 plus its index minus the number of moves
+  within the tableau
+- 0xC0-0xFF: a run of 1 to 64 consecutive draws from the stock, as 0xC0 plus
+  the length of the run minus one
+
+A file starts with a header holding MAGIC, the version of the format and the
+kind of records it holds (RECORD_DEALS, RECORD_SOLUTIONS or
+RECORD_INITIAL_DEALS), followed by the records.
+"""
+
+MAGIC = b"KLDK"
+VERSION = 1
+RECORD_DEALS = 0
+RECORD_SOLUTIONS = 1
+RECORD_INITIAL_DEALS = 2
+
+HEADER = struct.Struct("<4sBB")
+
+N_CARDS = 52
+N_PILES = 13
+MASK_SIZE = 7
+DEAL_SIZE = N_CARDS + MASK_SIZE + N_PILES
+INITIAL_DEAL_SIZE = N_CARDS + MASK_SIZE
+
+# Lengths of the piles of an initial deal: 24 cards in the stock, an empty
+# waste and foundations, and 1 to 7 cards in the tableau columns
+INITIAL_LENGTHS = bytes([24, 0, 0, 0, 0, 0, 1, 2, 3, 4, 5, 6, 7])
+
+MOVES_LENGTH = struct.Struct("<H")
+
+MAX_DRAW_RUN = 64
+
+action_table = LegalMoveChecker.action_table
+action_indices = LegalMoveChecker.action_indices
+n_tableau_moves = sum(1 for move in action_table if move[0] == "m")
+draw_index = action_indices[("d",)]
+
+
+def board_piles(board: SolitaireBoard):
+    """Returns the piles of the board in the order used by the format."""
+    return (
+        [board.stock, board.waste]
+        + [board.foundations[suit] for suit in Card.suits]
+        + board.tableau
+    )
+
+
+def encode_deal(board: SolitaireBoard):
+    """Returns the DEAL_SIZE bytes record of the given board."""
+    piles = board_piles(board)
+    cards = [card for pile in piles for card in pile]
+    if len(cards) != N_CARDS:
+        raise ValueError(f"Invalid number of cards {len(cards)}")
+
+    permutation = bytes(card.compact() & 0x3F for card in cards)
+
+    mask = 0
+    for i, card in enumerate(cards):
+        if card.hidden:
+            mask |= 1 << i
+
+    lengths = bytes(len(pile) for pile in piles)
+
+    return permutation + mask.to_bytes(MASK_SIZE, "little") + lengths
+
+
+def decode_deal(data: bytes):
+    """Reconstructs a board from its DEAL_SIZE bytes record."""
+    if len(data) < DEAL_SIZE:
+        raise ValueError("Truncated deal")
+
+    mask = int.from_bytes(data[N_CARDS : N_CARDS + MASK_SIZE], "little")
+    lengths = data[N_CARDS + MASK_SIZE : DEAL_SIZE]
+
+    if sum(lengths) != N_CARDS:
+        raise ValueError("Invalid pile lengths")
+
+    piles = []
+    pos = 0
+    for length in lengths:
+        piles.append(
+            [
+                Card.from_compact(data[i] | (0x40 if mask >> i & 1 else 0))
+                for i in range(pos, pos + length)
+            ]
+        )
+        pos += length
+
+    stock, waste = piles[0], piles[1]
+    foundations = dict(zip(Card.suits, piles[2:6]))
+    tableau = piles[6:]
+
+    return SolitaireBoard(tableau, foundations, stock, waste)
+
+
+def encode_initial_deal(board: SolitaireBoard):
+    """Returns the INITIAL_DEAL_SIZE bytes record of the given initial deal."""
+    record = encode_deal(board)
+    if record[INITIAL_DEAL_SIZE:] != INITIAL_LENGTHS:
+        raise ValueError("Not an initial deal")
+
+    return record[:INITIAL_DEAL_SIZE]
+
+
+def decode_initial_deal(data: bytes):
+    """Reconstructs a board from its INITIAL_DEAL_SIZE bytes record."""
+    if len(data) < INITIAL_DEAL_SIZE:
+        raise ValueError("Truncated deal")
+
+    return decode_deal(bytes(data[:INITIAL_DEAL_SIZE]) + INITIAL_LENGTHS)
+
+
+def normalize_move(move: tuple | list):
+    """Returns the given move as it appears in the action table (moves read
+    from JSON are lists, and the size of tableau moves may be omitted)."""
+    command = move[0]
+    if command == "m":
+        size = int(move[3]) if len(move) > 3 else 1
+        return ("m", int(move[1]), int(move[2]), size)
+    if command in ("f", "w"):
+        return (command, int(move[1]))
+
+    return (command,)
+
+
+def encode_moves(moves: list):
+    """Returns the byte string of the given moves."""
+    ret = bytearray()
+    draw_run = 0
+
+    for move in moves:
+        move = normalize_move(move)
+        if move not in action_indices:
+            raise ValueError(f"Move {move} is not in the action table")
+
+        index = action_indices[move]
+        if index != draw_index:
+            draw_run = 0
+
+        if index == draw_index:
+            # Extend the current run of draws, if there is one
+            if 0 < draw_run < MAX_DRAW_RUN:
+                ret[-1] += 1
+                draw_run += 1
+            else:
+                ret.append(0xC0)
+                draw_run = 1
+        elif index < n_tableau_moves:
+            ret.extend(index.to_bytes(2, "big"))
+        else:
+            ret.append(0x80 + index - n_tableau_moves)
+
+    return bytes(ret)
+
+
+def decode_moves(data: bytes):
+    """Returns the moves stored in the given byte string."""
+    ret = []
+    pos = 0
+
+    while pos < len(data):
+        value = data[pos]
+        if value >= 0xC0:
+            ret.extend([action_table[draw_index]] * (value - 0xC0 + 1))
+            pos += 1
+        elif value >= 0x80:
+            ret.append(action_table[value - 0x80 + n_tableau_moves])
+            pos += 1
+        else:
+            if pos + 1 >= len(data):
+                raise ValueError("Truncated move")
+            ret.append(action_table[int.from_bytes(data[pos : pos + 2], "big")])
+            pos += 2
+
+    return ret
+
+
+def encode_solution(board: SolitaireBoard, moves: list):
+    """Returns the record of the given board and the moves that solve it."""
+    encoded_moves = encode_moves(moves)
+    return encode_deal(board) + MOVES_LENGTH.pack(len(encoded_moves)) + encoded_moves
+
+
+def decode_solution(data: bytes):
+    """Reconstructs a board and its moves from a solution record. Returns them
+    along with the size of the record."""
+    board = decode_deal(data)
+    (length,) = MOVES_LENGTH.unpack_from(data, DEAL_SIZE)
+    start = DEAL_SIZE + MOVES_LENGTH.size
+
+    if len(data) < start + length:
+        raise ValueError("Truncated solution")
+
+    return board, decode_moves(data[start : start + length]), start + length
+
+
+def write_file(path: str, records: list, kind: int):
+    """Writes a file with the given deal or solution records (as returned by
+    `encode_deal`, `encode_initial_deal` or `encode_solution`)."""
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, kind))
+        for record in records:
+            f.write(record)
+
+
+def read_file(path: str):
+    """Reads a file written by `write_file`, returning the kind of its records
+    and a list with a board (for deals) or a board and its moves (for
+    solutions) per record."""
+    with open(path, "rb") as f:
+        data = f.read()
+
+    if len(data) < HEADER.size:
+        raise ValueError("Truncated header")
+
+    magic, version, kind = HEADER.unpack_from(data)
+    if magic != MAGIC:
+        raise ValueError("Not a binary deal file")
+    if version != VERSION:
+        raise ValueError(f"Unsupported version {version}")
+
+    ret = []
+    pos = HEADER.size
+
+    if kind == RECORD_DEALS:
+        while pos < len(data):
+            ret.append(decode_deal(data[pos : pos + DEAL_SIZE]))
+            pos += DEAL_SIZE
+    elif kind == RECORD_INITIAL_DEALS:
+        while pos < len(data):
+            ret.append(decode_initial_deal(data[pos : pos + INITIAL_DEAL_SIZE]))
+            pos += INITIAL_DEAL_SIZE
+    elif kind == RECORD_SOLUTIONS:
+        view = memoryview(data)
+        while pos < len(data):
+            board, moves, size = decode_solution(view[pos:])
+            ret.append((board, moves))
+            pos += size
+    else:
+        raise ValueError(f"Invalid record kind {kind}")
+
+    return kind, ret
+
+
+def from_json(board_json: dict):
+    """Converts a board in the format of `SolitaireBoard.export` to its binary
+    record. If it has moves (like the boards exported by the solvers), a
+    solution record is returned; otherwise, a deal record."""
+    board = SolitaireBoard.generate_from_json(board_json)
+
+    if "moves" in board_json:
+        return encode_solution(board, board_json["moves"])
+
+    return encode_deal(board)
+
+
+def to_json(board: SolitaireBoard, moves: list | None = None):
+    """Converts a decoded deal (and its moves, for solutions) back to the
+    format of `SolitaireBoard.export`."""
+    ret = board.export()
+    if moves is not None:
+        ret["moves"] = moves
+
+    return ret
+
+
+def read_json_boards(path: str):
+    """Reads the boards of a JSON file (a single board) or a JSONL file (one
+    board per line, like solution archives)."""
+    with open(path, "r") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line) for line in f if line.strip()]
+
+        return [json.load(f)]
+
+
+def main():
+    if len(sys.argv) < 4 or sys.argv[1] not in ("pack", "unpack"):
+        print(
+            f"Usage: {sys.argv[0]} pack <output.bin> <board.json|archive.jsonl>...\n"
+            f"       {sys.argv[0]} unpack <input.bin> <output.jsonl>",
+            file=sys.stderr,
+        )
+        sys.exit(1)
+
+    if sys.argv[1] == "pack":
+        boards = [board for path in sys.argv[3:] for board in read_json_boards(path)]
+        has_moves = ["moves" in board for board in boards]
+
+        if any(has_moves) and not all(has_moves):
+            print("Can't mix deals and solutions in one file", file=sys.stderr)
+            sys.exit(1)
+
+        records = [from_json(board) for board in boards]
+        kind = RECORD_SOLUTIONS if any(has_moves) else RECORD_DEALS
+
+        # Use the shorter records if every board is an initial deal
+        if kind == RECORD_DEALS and all(
+            record[INITIAL_DEAL_SIZE:] == INITIAL_LENGTHS for record in records
+        ):
+            kind = RECORD_INITIAL_DEALS
+            records = [record[:INITIAL_DEAL_SIZE] for record in records]
+
+        write_file(sys.argv[2], records, kind)
+        return
+
+    kind, records = read_file(sys.argv[2])
+    with open(sys.argv[3], "w") as f:
+        for record in records:
+            if kind == RECORD_SOLUTIONS:
+                board_json = to_json(*record)
+            else:
+                board_json = to_json(record)
+
+            f.write(json.dumps(board_json) + "\n")
+
+
+if __name__ == "__main__":
+    main()
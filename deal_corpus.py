@@ -0,0 +1,257 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import mmap
+import os
+import random
+from multiprocessing import Pool
+from binary_format import (
+    DEAL_SIZE,
+    HEADER,
+    INITIAL_DEAL_SIZE,
+    MAGIC,
+    RECORD_DEALS,
+    RECORD_INITIAL_DEALS,
+    VERSION,
+    decode_deal,
+    decode_initial_deal,
+    encode_deal,
+    encode_initial_deal,
+)
+from solitaire_board import SolitaireBoard
+
+"""
+Deal corpora: files in the format of binary_format.py holding fixed-size deal
+records, so the i-th deal is found at a known offset. A `DealCorpus` maps the
+file into memory and only decodes the deals that are accessed, so opening a
+corpus of millions of deals is immediate, and the processes reading the same
+corpus share its pages through the page cache.
+
+`NumberedDeals` is a range of numbered deals (see
+`SolitaireBoard.generate_from_number`), generated when accessed. It needs no
+file at all, so it's the cheapest way to hand the same deals to many processes
+or machines. Any other list of boards can be turned into `PackedDeals`, a
+single byte string of deal records that is cheap to send to other processes.
+"""
+
+# Number of deals generated by every task of `write_corpus`
+shard_size = 10_000
+
+record_formats = {
+    RECORD_INITIAL_DEALS: (INITIAL_DEAL_SIZE, decode_initial_deal),
+    RECORD_DEALS: (DEAL_SIZE, decode_deal),
+}
+
+
+class DealCorpus:
+    def __init__(self, path: str):
+        """Maps the corpus at the given path into memory."""
+        self.path = path
+        self.__open()
+
+    def __open(self):
+        with open(self.path, "rb") as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+        if len(self.data) < HEADER.size:
+            raise ValueError("Truncated header")
+
+        magic, version, kind = HEADER.unpack_from(self.data)
+        if magic != MAGIC:
+            raise ValueError("Not a binary deal file")
+        if version != VERSION:
+            raise ValueError(f"Unsupported version {version}")
+        if kind not in record_formats:
+            raise ValueError("Not a deal corpus")
+
+        self.record_size, self.decode = record_formats[kind]
+        self.count = (len(self.data) - HEADER.size) // self.record_size
+
+    def __getstate__(self):
+        # Only the path is sent to other processes, which map the file again
+        return self.path
+
+    def __setstate__(self, path):
+        self.path = path
+        self.__open()
+
+    def __len__(self):
+        return self.count
+
+    def record(self, index: int):
+        """Returns the raw record of the deal with the given index."""
+        if index < 0:
+            index += self.count
+        if index < 0 or index >= self.count:
+            raise IndexError("Deal index out of range")
+
+        start = HEADER.size + index * self.record_size
+        return self.data[start : start + self.record_size]
+
+    def __getitem__(self, index: int | slice):
+        """Decodes the deal with the given index (or a list of deals, for a
+        slice)."""
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(self.count))]
+
+        return self.decode(self.record(index))
+
+    def __iter__(self):
+        for i in range(self.count):
+            yield self[i]
+
+
+class NumberedDeals:
+    def __init__(self, start: int, stop: int):
+        """Creates the sequence of the deals numbered from `start` to `stop`
+        (not included)."""
+        self.numbers = range(start, stop)
+
+    def __len__(self):
+        return len(self.numbers)
+
+    def __getitem__(self, index: int | slice):
+        """Generates the deal with the given index (or a list of deals, for a
+        slice)."""
+        if isinstance(index, slice):
+            return [SolitaireBoard.generate_from_number(i) for i in self.numbers[index]]
+
+        return SolitaireBoard.generate_from_number(self.numbers[index])
+
+    def __iter__(self):
+        for number in self.numbers:
+            yield SolitaireBoard.generate_from_number(number)
+
+
+class PackedDeals:
+    def __init__(self, boards):
+        """Packs the given boards as consecutive deal records (see
+        `binary_format.encode_deal`)."""
+        self.data = b"".join(encode_deal(board) for board in boards)
+
+    def __len__(self):
+        return len(self.data) // DEAL_SIZE
+
+    def __getitem__(self, index: int):
+        """Decodes the deal with the given index."""
+        if index < 0:
+            index += len(self)
+        if index < 0 or index >= len(self):
+            raise IndexError("Deal index out of range")
+
+        return decode_deal(self.data[index * DEAL_SIZE : (index + 1) * DEAL_SIZE])
+
+
+def pack_deals(boards):
+    """Returns the given boards in a form that is cheap to send to other
+    processes: corpora and numbered deals already are, and any other sequence
+    of boards is packed into `PackedDeals`."""
+    if isinstance(boards, (DealCorpus, NumberedDeals, PackedDeals)):
+        return boards
+
+    return PackedDeals(boards)
+
+
+def parse_deal_range(text: str):
+    """Parses a range of deal numbers, given as `<start>:<stop>` (`stop` not
+    included) or as a single number, returning its `NumberedDeals`."""
+    start, sep, stop = text.partition(":")
+
+    try:
+        start = int(start)
+        stop = int(stop) if sep else start + 1
+    except ValueError:
+        raise ValueError(f"Invalid deal range {text}")
+
+    if start < 0 or stop < start:
+        raise ValueError(f"Invalid deal range {text}")
+
+    return NumberedDeals(start, stop)
+
+
+def is_corpus(path: str):
+    """Returns whether the given file is in the binary format."""
+    with open(path, "rb") as f:
+        return f.read(len(MAGIC)) == MAGIC
+
+
+def write_shard(path: str, start: int, stop: int, first_deal: int | None):
+    """Generates the deals from `start` to `stop` of a corpus and writes them in
+    place. The deals are random, or numbered from `first_deal` if given. Runs
+    in the worker processes of `write_corpus`."""
+    if first_deal is None:
+        # Forked workers inherit the state of the generator, so it's reseeded
+        random.seed()
+        boards = (SolitaireBoard.generate_random() for _ in range(start, stop))
+    else:
+        boards = NumberedDeals(first_deal + start, first_deal + stop)
+
+    data = b"".join(encode_initial_deal(board) for board in boards)
+
+    fd = os.open(path, os.O_WRONLY)
+    try:
+        os.pwrite(fd, data, HEADER.size + start * INITIAL_DEAL_SIZE)
+    finally:
+        os.close(fd)
+
+
+def write_corpus(
+    path: str,
+    count: int,
+    processes: int | None = None,
+    first_deal: int | None = None,
+):
+    """Writes a corpus of `count` deals, generated in parallel. The deals are
+    random, or numbered from `first_deal` if given."""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+
+    # The file is created with its final size, so every shard can be written
+    # at its offset independently
+    with open(path, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, RECORD_INITIAL_DEALS))
+        f.truncate(HEADER.size + count * INITIAL_DEAL_SIZE)
+
+    shards = [
+        (path, start, min(start + shard_size, count), first_deal)
+        for start in range(0, count, shard_size)
+    ]
+
+    with Pool(processes) as p:
+        p.starmap(write_shard, shards)
+
+
+def load_boards(paths: list[str]):
+    """Loads the boards of the given files. A single corpus is returned as a
+    `DealCorpus`, so its deals are only decoded when accessed; otherwise, a
+    list with the boards of every file (JSON files or corpora) is returned."""
+    if len(paths) == 1 and is_corpus(paths[0]):
+        return DealCorpus(paths[0])
+
+    boards = []
+    for path in paths:
+        if is_corpus(path):
+            boards.extend(DealCorpus(path))
+            continue
+
+        with open(path, "r") as f:
+            boards.append(SolitaireBoard.generate_from_json(json.load(f)))
+
+    return boards
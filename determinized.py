@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import json
+import random
+import sys
+import time
+from collections import Counter
+from functools import partial
+from multiprocessing import Pool, TimeoutError
+from solitaire_board import SolitaireBoard
+from dfs import dfs_search, get_search_moves
+
+"""
+This script recommends a move for a board without using the identity of the
+cards the player can't see (the hidden cards of the tableau and, unless told
+otherwise, the stock). It samples many boards (determinizations) that are
+consistent with what is visible, solves every legal move on each of them with
+DFS in a process pool and recommends the move that wins on the largest
+fraction of the samples evaluated within a time budget.
+"""
+
+n_samples = 64
+max_nodes = 500
+n_processes = 12
+# Seconds given to a recommendation. Probes still running when it runs out
+# are discarded, so the recommendation uses the samples evaluated in time
+time_budget = 5.0
+
+# Positions already evaluated by this worker process during the current
+# recommendation (the pool is created for every recommendation). Samples
+# often reach the same positions (always, once few cards are left hidden).
+solved_cache = {}
+
+
+def sample_determinization(
+    board: SolitaireBoard, rng: random.Random, known_stock: bool = False
+):
+    """Returns a copy of the board where the cards the player can't see have
+    been shuffled among themselves. Visible cards and the hidden flags are left
+    untouched."""
+    board = SolitaireBoard.generate_from_compact(board.export_compact())
+
+    unseen = [card for col in board.tableau for card in col if card.hidden]
+    if not known_stock:
+        unseen += board.stock
+
+    identities = [(card.number, card.suit) for card in unseen]
+    rng.shuffle(identities)
+
+    for card, (number, suit) in zip(unseen, identities):
+        card.number = number
+        card.suit = suit
+
+    return board
+
+
+def is_solvable(state: bytes, max_nodes: int, deadline: float):
+    """Returns whether DFS finds a solution for the board with the given
+    compact state within `max_nodes` nodes, using the cache of the process.
+    Returns None if the deadline passed before the search finished."""
+    if state not in solved_cache:
+        board = SolitaireBoard.generate_from_compact(state)
+        moves, _ = dfs_search(board, max_nodes, deadline=deadline)
+
+        if moves is None and time.monotonic() >= deadline:
+            return None
+
+        solved_cache[state] = moves is not None
+
+    return solved_cache[state]
+
+
+def evaluate_move(task: tuple, max_nodes: int, deadline: float):
+    """Plays a move on the board with the given compact state, returning the
+    move and whether the resulting board can be solved (None if the deadline
+    passed first)."""
+    state, move = task
+
+    board = SolitaireBoard.generate_from_compact(state)
+    board.play_move(move)
+
+    return move, is_solvable(board.export_compact(), max_nodes, deadline)
+
+
+def recommend_move(
+    board: SolitaireBoard,
+    n_samples: int = n_samples,
+    max_nodes: int = max_nodes,
+    n_processes: int = n_processes,
+    known_stock: bool = False,
+    seed: int | None = None,
+    time_budget: float = time_budget,
+):
+    """Recommends a move for the given board using up to `n_samples`
+    determinizations, evaluated for at most `time_budget` seconds. Every move
+    is probed on the samples in turn, so all of them get about the same number
+    of samples when time runs out. Returns the recommended move (or None if
+    there are no legal moves), a Counter with the number of samples won by
+    each move and a Counter with the number of samples each move was probed
+    on."""
+    deadline = time.monotonic() + time_budget
+
+    moves = get_search_moves(board)
+    if len(moves) == 0:
+        return None, Counter(), Counter()
+
+    rng = random.Random(seed)
+    samples = [
+        sample_determinization(board, rng, known_stock).export_compact()
+        for _ in range(n_samples)
+    ]
+    tasks = [(state, move) for state in samples for move in moves]
+
+    wins = Counter({move: 0 for move in moves})
+    trials = Counter({move: 0 for move in moves})
+
+    # The pool is terminated when leaving the block, dropping the probes that
+    # didn't finish in time
+    with Pool(n_processes) as p:
+        results = p.imap_unordered(
+            partial(evaluate_move, max_nodes=max_nodes, deadline=deadline), tasks
+        )
+
+        for _ in tasks:
+            try:
+                move, won = results.next(max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                break
+
+            if won is None:
+                continue
+
+            trials[move] += 1
+            wins[move] += won
+
+    # Ties are broken by the order of `get_search_moves`
+    best_move = max(moves, key=lambda move: wins[move] / max(trials[move], 1))
+
+    return best_move, wins, trials
+
+
+def main():
+    if len(sys.argv) < 2 or (sys.argv[1] == "--deal" and len(sys.argv) < 3):
+        print(f"Usage: {sys.argv[0]} <board_file> | --deal <n>", file=sys.stderr)
+        sys.exit(1)
+
+    if sys.argv[1] == "--deal":
+        board = SolitaireBoard.generate_from_number(int(sys.argv[2]))
+    else:
+        with open(sys.argv[1], "r") as f:
+            board_json = f.read()
+            board_json = json.loads(board_json)
+
+        board = SolitaireBoard.generate_from_json(board_json)
+    board.print_game()
+
+    move, wins, trials = recommend_move(board)
+    if move is None:
+        print("No legal moves")
+        return
+
+    for other_move, count in wins.most_common():
+        print(f"{other_move}: {count}/{trials[other_move]}")
+    print(f"Recommended move: {move}")
+
+
+if __name__ == "__main__":
+    main()
@@ -20,48 +20,75 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 
 import sys
+import time
 import networkx as nx
-import os
 from legal_moves import LegalMoveChecker
 from solitaire_board import SolitaireBoard
 from copy import deepcopy
-from random import shuffle
-import json
-import datetime
+import random
+from solution_archive import SolutionArchive
 
+# Archive where solutions are appended when no other one is given
+default_archive = "boards/solutions.jsonl"
 
-def export_board(board: SolitaireBoard, moves: list[tuple]):
-    """Exports a given SolitaireBoard instance to a JSON file, including the
-    moves used to arrive to a solution from this board."""
 
-    if not os.path.exists("boards"):
-        os.makedirs("boards")
+def export_board(
+    board: SolitaireBoard, moves: list[tuple], archive_path: str = default_archive
+):
+    """Appends a given SolitaireBoard instance to a solution archive (see
+    `SolutionArchive`), including the moves used to arrive to a solution from
+    this board."""
 
-    timestamp = datetime.datetime.now().isoformat(timespec="seconds")
+    SolutionArchive(archive_path).append(board, moves)
 
-    exported_board = board.export()
-    exported_board["moves"] = moves
 
-    with open(f"boards/board-{timestamp}.json", "w") as f:
-        json.dump(exported_board, f)
+def get_search_moves(board: SolitaireBoard):
+    """Returns the legal moves worth exploring from the given board."""
+    legal_moves = LegalMoveChecker(board).get_legal_moves()
 
+    # If the board is ready to be won (all cards are in the tableau, they are
+    # all face up and in order), ignore moves that don't move cards to the
+    # foundation
+    if board.check_if_ready_to_win():
+        legal_moves = [move for move in legal_moves if move[0] == "f"]
 
-def dfs_traversal(
+    return legal_moves
+
+
+def print_progress(nodes: int, board: SolitaireBoard):
+    """Progress callback of the solvers that clears the terminal and prints the
+    board being explored."""
+    print("\x1b[2J\x1b[H")
+    print("Number of nodes:", nodes)
+    board.print_game()
+
+
+def dfs_search(
     start_node: SolitaireBoard,
     max_nodes: int,
     max_depth: int = 150,
-    print_output: bool = True,
+    on_progress=None,
+    deadline: float | None = None,
+    rng: random.Random | None = None,
 ):
     """Traverses through the possible moves for a given SolitaireBoard using DFS.
 
-    If any solution is found, the initial card configuration is saved to a JSON
-    file."""
+    Returns the moves of the solution found (or None if there is none) and the
+    number of nodes of the search graph. If given, `on_progress` is called with
+    the number of nodes and the current board every 100 nodes, and the search
+    gives up once `deadline` (as given by `time.monotonic`) has passed. Moves
+    are shuffled with `rng` (the global generator of `random` by default)."""
+
+    shuffle = rng.shuffle if rng is not None else random.shuffle
 
     graph = nx.DiGraph()
     visited = set()  # Set to keep track of visited nodes
     stack = [start_node]  # Stack to store nodes to be visited and their parent
 
     while stack:
+        if deadline is not None and time.monotonic() >= deadline:
+            return None, graph.number_of_nodes()
+
         # Get the next node and its parent from the stack
         current_node = stack.pop()
 
@@ -70,21 +97,13 @@ def dfs_traversal(
             continue
 
         if current_node not in visited:
-            if print_output and graph.number_of_nodes() % 100 == 0:
-                print("\x1b[2J\x1b[H")
-                print("Number of nodes:", graph.number_of_nodes())
-                current_node.print_game()
+            if on_progress is not None and graph.number_of_nodes() % 100 == 0:
+                on_progress(graph.number_of_nodes(), current_node)
 
             visited.add(current_node)
             graph.add_node(current_node)
 
             if current_node.check_if_won():
-                if print_output:
-                    print("You won!")
-                    print("Number of nodes:", graph.number_of_nodes())
-                    print("Number of edges:", graph.number_of_edges())
-                    print("Depth:", len(stack))
-
                 # Get the moves that led to the winning board
                 # shortest path from start_node to current_node
                 winning_moves = []
@@ -99,22 +118,11 @@ def dfs_traversal(
                     edge = graph.get_edge_data(from_node, to_node)
                     winning_moves.append(edge["move"])
 
-                if print_output:
-                    print("Moves:", len(winning_moves))
-                export_board(start_node, winning_moves)
-
-                return len(winning_moves)
+                return winning_moves, graph.number_of_nodes()
 
-            legal_checker = LegalMoveChecker(current_node)
-            legal_moves = legal_checker.get_legal_moves()
+            legal_moves = get_search_moves(current_node)
             shuffle(legal_moves)
 
-            # If the board is ready to be won (all cards are in the tableau,
-            # they are all face up and in order), ignore moves that don't move
-            # cards to the foundation
-            if current_node.check_if_ready_to_win():
-                legal_moves = [move for move in legal_moves if move[0] == "f"]
-
             # Add all legal moves to the stack
             for move in legal_moves:
                 new_node = deepcopy(current_node)
@@ -124,8 +132,42 @@ def dfs_traversal(
                 graph.add_edge(current_node, new_node, move=move)
 
                 if graph.number_of_nodes() > max_nodes:
-                    if print_output:
-                        print("Max nodes exceeded")
-                    return -1
+                    return None, graph.number_of_nodes()
 
                 stack.append(new_node)
+
+    return None, graph.number_of_nodes()
+
+
+def dfs_traversal(
+    start_node: SolitaireBoard,
+    max_nodes: int,
+    max_depth: int = 150,
+    print_output: bool = True,
+    export_solution: bool = True,
+):
+    """Traverses through the possible moves for a given SolitaireBoard using
+    `dfs_search`, returning the number of moves of the solution (or -1 if none
+    is found).
+
+    If any solution is found and `export_solution` is set, the initial card
+    configuration is saved to a JSON file."""
+
+    winning_moves, nodes = dfs_search(
+        start_node, max_nodes, max_depth, print_progress if print_output else None
+    )
+
+    if winning_moves is None:
+        if print_output:
+            print("No solution found")
+            print("Number of nodes:", nodes)
+        return -1
+
+    if print_output:
+        print("You won!")
+        print("Number of nodes:", nodes)
+        print("Moves:", len(winning_moves))
+    if export_solution:
+        export_board(start_node, winning_moves)
+
+    return len(winning_moves)
@@ -18,64 +18,533 @@ You should have received a copy of the GNU General Public License
 along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
-from multiprocessing import Pool
-import sys
+from dataclasses import asdict
+from functools import partial
+from multiprocessing import Pool, Process, Queue
+import argparse
+import math
+import queue
+import shutil
+import tempfile
 import time
+from statistics import NormalDist
 from solitaire_board import SolitaireBoard
-import json
-from dfs import dfs_traversal
+from dfs import default_archive, print_progress
+from solver import SolveConfig, SolveResult, solve, solvers
+from solver_server import request_solve
+from solution_archive import SolutionArchive
+from deal_corpus import load_boards, pack_deals, parse_deal_range
 
 max_nodes = 10_000
+max_depth = 150
 n_threads = 12
 n_bench_tests = 1000
 
+# Sequential bench runs (--precision) stop once the confidence interval of the
+# solve rate is narrow enough, but never before `min_sequential_tests` deals
+# nor after `max_sequential_tests` random deals
+min_sequential_tests = 100
+max_sequential_tests = 100_000
+# Deals being solved at once in a sequential run, per process
+sequential_window = 2
 
-def run_dfs(board=None):
+mcts_time_budget = 10.0
+mcts_exploration = 1.4
+mcts_rollouts_per_leaf = 8
+mcts_max_playout = 200
+
+beam_width = 1000
+beam_max_depth = 300
+
+guided_batch_size = 64
+guided_top_k = None
+
+# Strategies launched by the portfolio solver, as "<solver>" or
+# "<solver>:<seed>" (the seed is used for the random number generator of the
+# process running the strategy, so DFS with different seeds explores
+# different orders)
+portfolio_strategies = ["dfs:1", "dfs:2", "dfs:3", "dfs:4", "beam", "mcts"]
+
+
+def make_config(
+    solver="dfs",
+    workdir=None,
+    model=None,
+    seed=None,
+    print_output=False,
+    archive=default_archive,
+):
+    """Builds the configuration of a solver from the settings of this script.
+    Solutions are always appended to the given archive."""
+    return SolveConfig(
+        solver=solver,
+        seed=seed,
+        max_nodes=max_nodes,
+        max_depth=max_depth,
+        workdir=workdir,
+        time_budget=mcts_time_budget,
+        exploration=mcts_exploration,
+        rollouts_per_leaf=mcts_rollouts_per_leaf,
+        max_playout=mcts_max_playout,
+        beam_width=beam_width,
+        beam_max_depth=beam_max_depth,
+        model=model,
+        batch_size=guided_batch_size,
+        top_k=guided_top_k,
+        on_progress=print_progress if print_output else None,
+        on_solution=SolutionArchive(archive).append,
+    )
+
+
+def print_result(result: SolveResult):
+    if result.solved:
+        print("You won!")
+    else:
+        print("No solution found")
+
+    print("Number of nodes:", result.nodes)
+    if result.solved:
+        print("Moves:", len(result.moves))
+    print(f"Time: {result.elapsed:.2f} s")
+
+
+def run_strategy(state, strategy, workdir, model, results):
+    """Runs a single portfolio strategy on the board with the given compact
+    state, putting its name and result in the `results` queue."""
+    board = SolitaireBoard.generate_from_compact(state)
+    solver, _, seed = strategy.partition(":")
+    config = make_config(solver, workdir, model, int(seed) if seed else None)
+
+    # Only the solution of the winner is exported, by the parent process
+    config.on_solution = None
+
+    try:
+        result = solve(board, config)
+    except Exception:
+        result = SolveResult(solver, False)
+
+    results.put((strategy, result))
+
+
+def solve_portfolio(
+    board,
+    strategies,
+    print_output=True,
+    workdir=None,
+    model=None,
+    archive=default_archive,
+):
+    """Runs the given strategies on the same board in parallel processes. As
+    soon as one of them finds a solution, the rest are terminated and the
+    solution is appended to `archive`. Returns the result of the winning
+    strategy (or None if no strategy found a solution) and its name."""
+    # Terminated strategies don't clean up their files (e.g. the layers of
+    # bfs), so every strategy gets its own directory, removed at the end
+    workdirs = [
+        tempfile.mkdtemp(prefix="portfolio-", dir=workdir) for _ in strategies
+    ]
+
+    results = Queue()
+    processes = [
+        Process(
+            target=run_strategy,
+            args=(board.export_compact(), strategy, strategy_workdir, model, results),
+        )
+        for strategy, strategy_workdir in zip(strategies, workdirs)
+    ]
+
+    for process in processes:
+        process.start()
+
+    winner = None
+    winning_result = None
+    received = 0
+    while received < len(processes):
+        try:
+            strategy, result = results.get(timeout=0.1)
+        except queue.Empty:
+            # A strategy may die without putting a result (killed, crashed in
+            # native code...), so stop waiting once every process has exited.
+            # Results put before exiting are already in the queue's pipe
+            if all(process.exitcode is not None for process in processes):
+                try:
+                    strategy, result = results.get_nowait()
+                except queue.Empty:
+                    break
+            else:
+                continue
+
+        received += 1
+        if result.solved:
+            winner = strategy
+            winning_result = result
+            break
+
+    for process in processes:
+        if process.is_alive():
+            process.terminate()
+        process.join()
+
+    for strategy_workdir in workdirs:
+        shutil.rmtree(strategy_workdir, ignore_errors=True)
+
+    if winning_result is not None:
+        SolutionArchive(archive).append(board, winning_result.moves)
+
+    if print_output:
+        if winner is not None:
+            print(f"Solved by {winner} in {len(winning_result.moves)} moves")
+        else:
+            print("No strategy found a solution")
+
+    return winning_result, winner
+
+
+def run_dfs(
+    board=None, solver="dfs", workdir=None, model=None, archive=default_archive
+):
+    """Solves the given board (or a random one), returning the number of moves
+    of the solution or -1."""
     initial_board = SolitaireBoard.generate_random() if board is None else board
-    moves = dfs_traversal(initial_board, max_nodes, 150, False)
+    result = solve(initial_board, make_config(solver, workdir, model, archive=archive))
+
+    return len(result.moves) if result.solved else -1
+
+
+# Deals solved by the pool workers of a bench run (or None for random ones), set
+# by `set_deals` when the pool starts. They are sent once per worker in the
+# compact form returned by `pack_deals`, and every task only carries the index
+# of its deal, so workers decode boards themselves as they solve them
+deals = None
+
+
+def set_deals(bench_deals):
+    global deals
+    deals = bench_deals
+
+
+def run_deal(index, **kwargs):
+    return run_dfs(deals[index] if deals is not None else None, **kwargs)
+
+
+def wilson_interval(solved: int, total: int, confidence: float):
+    """Returns the Wilson score interval of the solve rate, given the number
+    of solved deals out of `total`."""
+    if total == 0:
+        return 0.0, 1.0
 
-    out = f"{moves}"
+    z = NormalDist().inv_cdf(0.5 + confidence / 2)
+    rate = solved / total
+    denominator = 1 + z * z / total
+    center = (rate + z * z / (2 * total)) / denominator
+    margin = (
+        z * math.sqrt(rate * (1 - rate) / total + z * z / (4 * total * total))
+    ) / denominator
+
+    return max(0.0, center - margin), min(1.0, center + margin)
+
+
+def print_solve_rate(results: list, confidence: float):
+    """Prints the solve rate of a bench run and its confidence interval. Every
+    result starts with the number of moves of the solution (or -1)."""
+    solved = sum(1 for result in results if int(result.split(",")[0]) >= 0)
+    low, high = wilson_interval(solved, len(results), confidence)
+
+    print(
+        f"Solve rate: {solved / max(len(results), 1):.1%} "
+        f"({confidence:.0%} CI {low:.1%}-{high:.1%}, {len(results)} deals)"
+    )
+
+
+def solve_sequential(pool, run, count: int, precision: float, confidence: float):
+    """Solves deals 0 to `count` - 1 with `run` in the given pool until the
+    confidence interval of the solve rate has a half-width of at most
+    `precision`. Only a few deals per process are dispatched at once, so no new
+    deals are started once the precision is reached. Results are counted in the
+    order of the deals (not in the order they finish, which would favor the
+    deals that are solved quickly), and returned as strings."""
+    completed = queue.Queue()
+    window = n_threads * sequential_window
+    next_deal = 0
+    pending = 0
+
+    def dispatch():
+        nonlocal next_deal, pending
+        index = next_deal
+        pool.apply_async(
+            run,
+            (index,),
+            callback=lambda moves: completed.put((index, moves)),
+            error_callback=lambda e: completed.put((index, e)),
+        )
+        next_deal += 1
+        pending += 1
+
+    while next_deal < min(window, count):
+        dispatch()
+
+    finished = {}
+    results = []
+    solved = 0
+    while pending > 0:
+        index, moves = completed.get()
+        pending -= 1
+        if isinstance(moves, BaseException):
+            raise moves
+
+        finished[index] = moves
+        while len(results) in finished:
+            moves = finished.pop(len(results))
+            print(moves)
+            results.append(f"{moves}")
+            if moves >= 0:
+                solved += 1
+
+        low, high = wilson_interval(solved, len(results), confidence)
+        if len(results) >= min_sequential_tests and (high - low) / 2 <= precision:
+            break
+
+        if next_deal < count:
+            dispatch()
+
+    return results
+
+
+def run_portfolio(
+    board=None, strategies=(), workdir=None, model=None, archive=default_archive
+):
+    initial_board = SolitaireBoard.generate_random() if board is None else board
+    result, winner = solve_portfolio(
+        initial_board, strategies, False, workdir, model, archive
+    )
+
+    out = f"{len(result.moves) if result is not None else -1},{winner}"
     print(out)
 
     return out
 
 
+def solve_remote(url, boards, config, archive=default_archive):
+    """Solves the given boards with a running `solver_server.py`, returning
+    the number of moves of each solution (or -1) in the order of `boards`.
+    Solutions are appended to `archive`."""
+    config = asdict(config)
+    # The model and the work directory are set by the server
+    for name in ("on_progress", "on_solution", "model", "workdir"):
+        del config[name]
+
+    results = ["-1"] * len(boards)
+    for result in request_solve(url, [board.export() for board in boards], config):
+        moves = len(result["moves"]) if result.get("solved") else -1
+        results[result["index"]] = f"{moves}"
+        print(moves)
+
+        if result.get("solved"):
+            SolutionArchive(archive).append(boards[result["index"]], result["moves"])
+
+    return results
+
+
 def main():
-    initial_board = None
-    if len(sys.argv) > 1 and sys.argv[1] != "--bench":
-        with open(sys.argv[1], "r") as f:
-            board_json = f.read()
-            board_json = json.loads(board_json)
-
-        initial_board = SolitaireBoard.generate_from_json(board_json)
-    elif len(sys.argv) > 1 and sys.argv[1] == "--bench":
-        timestr = time.strftime("%Y%m%d-%H%M%S")
-        log_file = open(f"dfs-bench-{timestr}.csv", "w")
+    parser = argparse.ArgumentParser(description="Solves Klondike boards")
+    parser.add_argument(
+        "--bench",
+        action="store_true",
+        help="solve many boards in parallel and log the results",
+    )
+    parser.add_argument(
+        "--solver",
+        choices=solvers + ["portfolio"],
+        default="dfs",
+        help="search algorithm (bfs finds shortest solutions using disk, mcts "
+        "returns the first solution found within a time budget, beam keeps the "
+        "best positions of every layer, guided orders the dfs by the Q-values "
+        "of a trained model, portfolio races several strategies)",
+    )
+    parser.add_argument(
+        "--strategies",
+        default=",".join(portfolio_strategies),
+        help="comma-separated strategies raced by the portfolio solver, as "
+        "<solver> or <solver>:<seed> (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="directory where the bfs solver stores its layers",
+    )
+    parser.add_argument(
+        "--model",
+        default=None,
+        help="PTH file generated by rl_train.py, used by the guided solver",
+    )
+    parser.add_argument(
+        "--server",
+        default=None,
+        help="URL of a running solver_server.py to send the boards to",
+    )
+    parser.add_argument(
+        "--archive",
+        default=None,
+        help="JSONL archive where solutions are appended (default: a new "
+        "boards/solutions-<timestamp>.jsonl for every run)",
+    )
+    parser.add_argument(
+        "--deals",
+        default=None,
+        help="solve the numbered deals of a range, as <start>:<stop> or a "
+        "single number, instead of board files",
+    )
+    parser.add_argument(
+        "--precision",
+        type=float,
+        default=None,
+        help="bench until the confidence interval of the solve rate is at "
+        "most this wide on each side (e.g. 0.01), instead of solving a fixed "
+        "number of deals",
+    )
+    parser.add_argument(
+        "--confidence",
+        type=float,
+        default=0.95,
+        help="confidence level of the interval of the solve rate reported by "
+        "bench runs (default: %(default)s)",
+    )
+    parser.add_argument(
+        "boards", nargs="*", help="boards to solve (JSON files or a deal corpus)"
+    )
+    args = parser.parse_args()
+
+    # Deals given in the command line, or None to use random ones
+    boards = None
+    if args.deals is not None:
+        if len(args.boards) > 0:
+            parser.error("board files can't be used with --deals")
+
+        try:
+            boards = parse_deal_range(args.deals)
+        except ValueError as e:
+            parser.error(str(e))
+    elif len(args.boards) > 0:
+        boards = load_boards(args.boards)
+
+    if not 0 < args.confidence < 1:
+        parser.error("the confidence must be between 0 and 1")
+    if args.precision is not None:
+        if not args.bench:
+            parser.error("--precision can only be used with --bench")
+        if args.solver == "portfolio" or args.server is not None:
+            parser.error("--precision can't be used with portfolio or --server")
+        if args.precision <= 0:
+            parser.error("the precision must be positive")
+
+    timestr = time.strftime("%Y%m%d-%H%M%S")
+    archive = args.archive or f"boards/solutions-{timestr}.jsonl"
 
-        if len(sys.argv) > 2:
-            json_files = sys.argv[2:]
-            boards = []
+    strategies = args.strategies.split(",")
+    for strategy in strategies:
+        if strategy.partition(":")[0] not in solvers:
+            parser.error(f"invalid strategy {strategy}")
 
-            for json_file in json_files:
-                with open(json_file, "r") as f:
-                    board_json = f.read()
-                    board_json = json.loads(board_json)
+    uses_model = args.solver == "guided" or (
+        args.solver == "portfolio"
+        and any(strategy.startswith("guided") for strategy in strategies)
+    )
+    if uses_model and args.model is None and args.server is None:
+        parser.error("the guided solver needs a --model")
 
-                boards.append(SolitaireBoard.generate_from_json(board_json))
+    if args.server is not None:
+        if args.solver == "portfolio":
+            parser.error("the portfolio solver can't be used with --server")
+        if args.model is not None or args.workdir is not None:
+            parser.error("--model and --workdir are set on the server")
 
-            with Pool(n_threads) as p:
-                results = p.map(run_dfs, boards)
+        if boards is not None:
+            boards = list(boards)
+        elif args.bench:
+            boards = [SolitaireBoard.generate_random() for _ in range(n_bench_tests)]
+        else:
+            boards = [SolitaireBoard.generate_random()]
+
+        config = make_config(args.solver, args.workdir, args.model)
+        results = solve_remote(args.server, boards, config, archive)
+
+        if args.bench:
+            with open(f"dfs-bench-{timestr}.csv", "w") as log_file:
+                log_file.write("\n".join(results))
+            print_solve_rate(results, args.confidence)
+        return
+
+    if args.bench:
+        log_file = open(f"dfs-bench-{timestr}.csv", "w")
 
+        if args.solver == "portfolio":
+            if boards is None:
+                boards = [None] * n_bench_tests
+
+            # Every board already uses one process per strategy (and pool
+            # workers can't start processes of their own)
+            run = partial(
+                run_portfolio,
+                strategies=strategies,
+                workdir=args.workdir,
+                model=args.model,
+                archive=archive,
+            )
+            results = [run(board) for board in boards]
         else:
-            with Pool(n_threads) as p:
-                results = p.map(run_dfs, [None] * n_bench_tests)
+            run = partial(
+                run_deal,
+                solver=args.solver,
+                workdir=args.workdir,
+                model=args.model,
+                archive=archive,
+            )
+            if boards is not None:
+                count = len(boards)
+            elif args.precision is not None:
+                count = max_sequential_tests
+            else:
+                count = n_bench_tests
+            pool_deals = pack_deals(boards) if boards is not None else None
+
+            # Tasks are sent in chunks to keep the IPC overhead of short
+            # solves low; results (a single int per deal) come back in order
+            chunksize = max(1, count // (n_threads * 8))
+
+            results = []
+            with Pool(n_threads, initializer=set_deals, initargs=(pool_deals,)) as p:
+                if args.precision is not None:
+                    results = solve_sequential(
+                        p, run, count, args.precision, args.confidence
+                    )
+                else:
+                    for moves in p.imap(run, range(count), chunksize):
+                        print(moves)
+                        results.append(f"{moves}")
 
         log_file.write("\n".join(results))
+        log_file.close()
+        print_solve_rate(results, args.confidence)
+        return
 
+    if boards is not None:
+        initial_board = boards[0]
     else:
         initial_board = SolitaireBoard.generate_random()
 
-    dfs_traversal(initial_board, max_nodes)
+    if args.solver == "portfolio":
+        solve_portfolio(
+            initial_board,
+            strategies,
+            workdir=args.workdir,
+            model=args.model,
+            archive=archive,
+        )
+    else:
+        config = make_config(
+            args.solver, args.workdir, args.model, print_output=True, archive=archive
+        )
+        print_result(solve(initial_board, config))
 
 
 if __name__ == "__main__":
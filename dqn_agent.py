@@ -35,15 +35,45 @@ import torch.optim as optim
 
 import numpy as np
 import random
-from collections import namedtuple, deque
 
-from model import QNetwork
-from replay_memory import ReplayBuffer
+from model import EmbeddingQNetwork, QNetwork
+from observation import decode_legal_masks, state_formats
+from replay_memory import (
+    Prefetcher,
+    PrioritizedReplayBuffer,
+    ReplayBuffer,
+    states_to_tensor,
+)
 
 # Determine if CPU or GPU computation should be used
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 
+def choose_actions(network, observations, eps, rng):
+    """Returns epsilon-greedy legal actions for the given observations (a row
+    per board), with a single forward pass of the network on its device."""
+    network_device = next(network.parameters()).device
+    decode = state_formats[network.state_format][0]
+    states = states_to_tensor(decode(observations), network_device)
+    with torch.no_grad():
+        action_values = network(states)
+
+    action_values = action_values.cpu().data.numpy()
+    legal = decode_legal_masks(observations)
+
+    # Greedy actions, among the legal ones
+    action_values[~legal] = -np.inf
+    actions = np.argmax(action_values, axis=1)
+
+    # Random legal actions (the legal action with the highest random key)
+    explore = rng.random(len(observations)) <= eps
+    if explore.any():
+        keys = np.where(legal[explore], rng.random(legal[explore].shape), -1)
+        actions[explore] = np.argmax(keys, axis=1)
+
+    return actions
+
+
 """
 ##################################################
 Agent Class
@@ -73,6 +103,9 @@ class Agent:
         target_tau=2e-3,
         update_rate=4,
         seed=0,
+        prioritized=False,
+        prefetch=0,
+        embedding=False,
     ):
         """
         DQN Agent Parameters
@@ -85,6 +118,9 @@ class Agent:
             gamma (float): paramete for setting the discoun ted value of future rewards (typically .95 to .995)
             learning_rate (float): specifies the rate of model learing (typically 1e-4 to 1e-3))
             seed (int): random seed for initializing training point.
+            prioritized (bool): sample the replay memory by priority (TD error) instead of uniformly
+            prefetch (int): number of batches sampled ahead in a background thread (0 samples them when learning)
+            embedding (bool): use an EmbeddingQNetwork, taking the card indices of the states instead of one-hot vectors
         """
         self.dqn_type = dqn_type
         self.state_size = state_size
@@ -95,7 +131,10 @@ class Agent:
         self.learn_rate = learning_rate
         self.tau = target_tau
         self.update_rate = update_rate
+        self.prioritized = prioritized
+        self.prefetch = prefetch
         self.seed = random.seed(seed)
+        self.rng = np.random.default_rng(seed)
 
         """
         # DQN Agent Q-Network
@@ -104,16 +143,32 @@ class Agent:
         # (b) A target network, with weights updated to equal the network at a slower (target_tau) rate.
         # The slower modulation of the target network weights operates to stablize learning.
         """
-        self.network = QNetwork(
+        network_class = EmbeddingQNetwork if embedding else QNetwork
+        self.network = network_class(
             state_size, action_size, seed, 1868, 1615, 1362, 1109
         ).to(device)
-        self.target_network = QNetwork(
+        self.target_network = network_class(
             state_size, action_size, seed, 1868, 1615, 1362, 1109
         ).to(device)
+        self.state_format = network_class.state_format
         self.optimizer = optim.Adam(self.network.parameters(), lr=self.learn_rate)
 
         # Replay memory
-        self.memory = ReplayBuffer(action_size, self.buffer_size, self.batch_size, seed)
+        if prioritized:
+            self.memory = PrioritizedReplayBuffer(
+                action_size,
+                self.buffer_size,
+                self.batch_size,
+                seed,
+                state_format=self.state_format,
+            )
+        else:
+            self.memory = ReplayBuffer(
+                action_size, self.buffer_size, self.batch_size, seed, self.state_format
+            )
+
+        # Started when the agent first learns
+        self.prefetcher = None
 
         # Initialize time step (for updating every UPDATE_EVERY steps)
         self.t_step = 0
@@ -130,21 +185,47 @@ class Agent:
         if self.t_step == 0:
             # If enough samples are available in memory, get random subset and learn
             if len(self.memory) > self.batch_size:
-                experiences = self.memory.sample()
+                experiences = self.sample()
                 self.learn(experiences, self.gamma)
 
+    def step_batch(self, states, actions, rewards, next_states, dones):
+        """Saves the experiences of every board of a VectorEnv (a row per
+        board), learning every update_rate experiences as in step()."""
+        for i in range(len(actions)):
+            self.memory.add(
+                states[i], actions[i], rewards[i], next_states[i], dones[i], stream=i
+            )
+
+            self.t_step = (self.t_step + 1) % self.update_rate
+            if self.t_step == 0 and len(self.memory) > self.batch_size:
+                self.learn(self.sample(), self.gamma)
+
+    def sample(self):
+        """Returns a batch of experiences from the replay memory (prefetched,
+        if prefetch is set)."""
+        if self.prefetch == 0:
+            return self.memory.sample()
+
+        if self.prefetcher is None:
+            self.prefetcher = Prefetcher(self.memory, self.prefetch)
+
+        return self.prefetcher.get()
+
     ########################################################
     # ACT() method
     #
-    def act(self, state, eps=0.0, legal_checker=None):
+    def act(self, observation, eps=0.0):
         """Returns actions for given state as per current policy.
 
         Params
         ======
-            state (array_like): current state
+            observation (array_like): current state, as returned by
+                observation.encode_observation
             eps (float): epsilon, for epsilon-greedy action selection
         """
-        state = torch.from_numpy(state).float().unsqueeze(0).to(device)
+        observation = observation[np.newaxis]
+        decode = state_formats[self.state_format][0]
+        state = states_to_tensor(decode(observation), device)
         self.network.eval()
         with torch.no_grad():
             action_values = self.network(state)
@@ -152,15 +233,8 @@ class Agent:
 
         action_values = action_values.cpu().data.numpy()
 
-        if legal_checker is not None:
-            # Get legal actions
-            legal_actions = legal_checker.encode_legal_moves()
-
-            # Convert to numpy array
-            legal_actions = np.array(legal_actions)
-
-            # Set illegal actions to -inf
-            action_values[0][legal_actions == 0] = -np.inf
+        # Set illegal actions to -inf
+        action_values[~decode_legal_masks(observation)] = -np.inf
 
         # If there are no legal actions, throw an error
         if np.all(action_values == -np.inf):
@@ -180,6 +254,23 @@ class Agent:
             # Return a random action from the indices
             return random.choice(indices)
 
+    def act_batch(self, observations, eps=0.0):
+        """Returns the actions for the given observations (a row per board of
+        a VectorEnv) as per current policy, with a single forward pass. Every
+        observation must have legal actions.
+
+        Params
+        ======
+            observations (array_like): current states, as returned by
+                observation.encode_observation
+            eps (float): epsilon, for epsilon-greedy action selection
+        """
+        self.network.eval()
+        actions = choose_actions(self.network, observations, eps, self.rng)
+        self.network.train()
+
+        return actions
+
     ########################################################
     # LEARN() method
     # Update value parameters using given batch of experience tuples.
@@ -187,37 +278,65 @@ class Agent:
         """
         Params
         ======
-            experiences (Tuple[torch.Variable]): tuple of (s, a, r, s', done) tuples
+            experiences (Tuple[torch.Variable]): tuple of (s, a, r, s', done, legal
+                actions of s') tuples (followed by the importance-sampling weights and
+                the indices of the memories, with prioritized replay)
             gamma (float): discount factor
         """
 
-        states, actions, rewards, next_states, dones = experiences
+        states, actions, rewards, next_states, dones, next_legal = experiences[:6]
 
         # Get Q values from current observations (s, a) using model nextwork
         Qsa = self.network(states).gather(1, actions)
 
+        # Only legal actions of s' are considered
+        illegal = ~next_legal
+
         if self.dqn_type == "DDQN":
             # Double DQN
             # ************************
             Qsa_prime_actions = (
-                self.network(next_states).detach().max(1)[1].unsqueeze(1)
+                self.network(next_states)
+                .detach()
+                .masked_fill(illegal, -np.inf)
+                .max(1)[1]
+                .unsqueeze(1)
+            )
+            Qsa_prime_targets = (
+                self.target_network(next_states).detach().gather(1, Qsa_prime_actions)
             )
-            Qsa_prime_targets = self.target_network(next_states)[
-                Qsa_prime_actions
-            ].unsqueeze(1)
 
         else:
             # Regular (Vanilla) DQN
             # ************************
             # Get max Q values for (s',a') from target model
             Qsa_prime_target_values = self.target_network(next_states).detach()
+            Qsa_prime_target_values = Qsa_prime_target_values.masked_fill(
+                illegal, -np.inf
+            )
             Qsa_prime_targets = Qsa_prime_target_values.max(1)[0].unsqueeze(1)
 
+        # Nothing follows a state without legal actions
+        Qsa_prime_targets = Qsa_prime_targets.masked_fill(
+            illegal.all(1, keepdim=True), 0.0
+        )
+
         # Compute Q targets for current states
         Qsa_targets = rewards + (gamma * Qsa_prime_targets * (1 - dones))
 
         # Compute loss (error)
-        loss = F.mse_loss(Qsa, Qsa_targets)
+        if self.prioritized:
+            weights, indices = experiences[6:]
+            td_errors = Qsa_targets.detach() - Qsa
+
+            # Weighted by the importance-sampling weights, and the TD errors
+            # become the new priorities of the memories
+            loss = (weights * td_errors.pow(2)).mean()
+            self.memory.update_priorities(
+                indices, td_errors.detach().squeeze(1).cpu().numpy()
+            )
+        else:
+            loss = F.mse_loss(Qsa, Qsa_targets)
 
         # Minimize the loss
         self.optimizer.zero_grad()
@@ -19,37 +19,52 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-import json
-from solitaire_board import SolitaireBoard
-import sys
-import uuid
-import os
+import argparse
+from deal_corpus import parse_deal_range, write_corpus
 
+"""
+This script generates random initial deals and writes them to a deal corpus
+(see deal_corpus.py), a single file with one fixed-size record per deal that
+`dfs_solver.py` and `rl_train.py` can read without decoding it up front.
+"""
 
-def export_board(board: SolitaireBoard):
-    """Exports a given SolitaireBoard instance to a JSON file, including the
-    moves used to arrive to a solution from this board."""
-
-    if not os.path.exists("boards/random"):
-        os.makedirs("boards/random", exist_ok=True)
-
-    board_id = str(uuid.uuid4())
-
-    exported_board = board.export()
-
-    with open(f"boards/random/{board_id}.json", "w") as f:
-        json.dump(exported_board, f)
+default_output = "boards/random.bin"
 
 
 def main():
-    if len(sys.argv) == 1:
-        print(f"usage: {sys.argv[0]} <count>", file=sys.stderr)
-        sys.exit(1)
-
-    count = int(sys.argv[1])
-    for _ in range(count):
-        board = SolitaireBoard.generate_random()
-        export_board(board)
+    parser = argparse.ArgumentParser(description="Generates random deals")
+    parser.add_argument("count", type=int, nargs="?", help="number of deals")
+    parser.add_argument(
+        "--deals",
+        default=None,
+        help="write the numbered deals of a range (as <start>:<stop>) instead "
+        "of random ones",
+    )
+    parser.add_argument(
+        "--output",
+        default=default_output,
+        help="corpus file to write (default: %(default)s)",
+    )
+    parser.add_argument(
+        "--processes",
+        type=int,
+        default=None,
+        help="number of processes generating deals (default: one per CPU)",
+    )
+    args = parser.parse_args()
+
+    if (args.count is None) == (args.deals is None):
+        parser.error("either a count or --deals is needed")
+
+    if args.deals is not None:
+        try:
+            numbers = parse_deal_range(args.deals).numbers
+        except ValueError as e:
+            parser.error(str(e))
+
+        write_corpus(args.output, len(numbers), args.processes, numbers.start)
+    else:
+        write_corpus(args.output, args.count, args.processes)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,145 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import functools
+import networkx as nx
+import numpy as np
+import torch
+from copy import deepcopy
+from legal_moves import LegalMoveChecker
+from model import EmbeddingQNetwork, QNetwork
+from observation import encode_observation, state_formats
+from replay_memory import states_to_tensor
+from solitaire_board import SolitaireBoard
+from dfs import get_search_moves
+
+# Determine if CPU or GPU computation should be used
+device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
+
+# Sizes used by `rl_train.py` and `dqn_agent.Agent`
+state_size = 4080
+action_size = 856
+hidden_units = (1868, 1615, 1362, 1109)
+
+
+@functools.lru_cache(maxsize=None)
+def load_network(weights_path: str):
+    """Loads a QNetwork (or an EmbeddingQNetwork, as detected from its
+    weights) trained by `rl_train.py` from a PTH file. The network is cached,
+    so every process only loads it once."""
+    weights = torch.load(weights_path, map_location=device)
+    network_class = (
+        EmbeddingQNetwork if "fc1.embedding.weight" in weights else QNetwork
+    )
+
+    network = network_class(state_size, action_size, 0, *hidden_units).to(device)
+    network.load_state_dict(weights)
+    network.eval()
+
+    return network
+
+
+def guided_dfs_search(
+    start_node: SolitaireBoard,
+    network: QNetwork,
+    max_nodes: int,
+    max_depth: int = 150,
+    batch_size: int = 64,
+    top_k: int | None = None,
+    on_progress=None,
+):
+    """Traverses through the possible moves for a given SolitaireBoard using
+    DFS, ordering the children of every node by the Q-values of the given
+    network (the move with the highest value is explored first). If `top_k` is
+    given, only the `top_k` best moves of every node are explored.
+
+    Nodes are expanded in slices of up to `batch_size` nodes taken from the top
+    of the stack, and the Q-values of a whole slice are computed in a single
+    forward pass.
+
+    Returns the moves of the solution found (or None if there is none) and the
+    number of nodes of the search graph. If given, `on_progress` is called with
+    the number of nodes and the first board of every slice."""
+
+    graph = nx.DiGraph()
+    visited = set()
+    stack = [(start_node, 0)]
+    moves_table = LegalMoveChecker(start_node)
+
+    graph.add_node(start_node)
+
+    while stack:
+        # Take the next slice of unvisited nodes from the stack
+        frontier = []
+        while stack and len(frontier) < batch_size:
+            node, depth = stack.pop()
+
+            if node in visited or depth > max_depth:
+                continue
+            visited.add(node)
+
+            if node.check_if_won():
+                winning_moves = []
+
+                shortest_path = nx.shortest_path(graph, start_node, node)
+                for from_node, to_node in zip(shortest_path, shortest_path[1:]):
+                    edge = graph.get_edge_data(from_node, to_node)
+                    winning_moves.append(edge["move"])
+
+                return winning_moves, graph.number_of_nodes()
+
+            frontier.append((node, depth))
+
+        if len(frontier) == 0:
+            continue
+
+        if on_progress is not None:
+            on_progress(graph.number_of_nodes(), frontier[0][0])
+
+        # States in the format of the network
+        observations = np.stack([encode_observation(node) for node, _ in frontier])
+        states = state_formats[network.state_format][0](observations)
+        with torch.no_grad():
+            q_values = network(states_to_tensor(states, device))
+        q_values = q_values.cpu().numpy()
+
+        # Push the slice in reverse, so its first node is expanded first
+        for (node, depth), node_q_values in reversed(list(zip(frontier, q_values))):
+            legal_moves = get_search_moves(node)
+            legal_moves.sort(
+                key=lambda move: node_q_values[moves_table.encode_move(move)],
+                reverse=True,
+            )
+
+            if top_k is not None:
+                legal_moves = legal_moves[:top_k]
+
+            # The best move is pushed last, so it is popped first
+            for move in reversed(legal_moves):
+                new_node = deepcopy(node)
+                new_node.play_move(move)
+
+                graph.add_node(new_node)
+                graph.add_edge(node, new_node, move=move)
+
+                if graph.number_of_nodes() > max_nodes:
+                    return None, graph.number_of_nodes()
+
+                stack.append((new_node, depth + 1))
+
+    return None, graph.number_of_nodes()
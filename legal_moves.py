@@ -1,5 +1,4 @@
 from solitaire_board import SolitaireBoard
-from copy import deepcopy
 
 """
 solitario_ia
@@ -20,48 +19,53 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 """
 
 
-class LegalMoveChecker:
-    __move_dict = []
+def build_action_table():
+    """Returns the list of every move the network can choose from. The index
+    of a move in this list is its action number."""
+    ret = []
+
+    # Move within tableau
+    for from_pile in range(7):
+        for to_pile in range(7):
+            if from_pile == to_pile:
+                continue
 
-    def __populate_move_dict(self):
-        self.__move_dict = []
+            for slice_length in range(1, 21):
+                ret.append(("m", from_pile, to_pile, slice_length))
 
-        # Move within tableau
-        for from_pile in range(7):
-            for to_pile in range(7):
-                if from_pile == to_pile:
-                    continue
+    # Draw from stock
+    ret.append(("d",))
 
-                for slice_length in range(1, 21):
-                    self.__move_dict.append(("m", from_pile, to_pile, slice_length))
+    # Move to foundation
+    for pile in range(7):
+        ret.append(("f", pile))
 
-        # Draw from stock
-        self.__move_dict.append(("d",))
+    # Move from waste
+    for pile in range(7):
+        ret.append(("w", pile))
 
-        # Move to foundation
-        for pile in range(7):
-            self.__move_dict.append(("f", pile))
+    # Move from waste to foundation
+    ret.append(("s",))
 
-        # Move from waste
-        for pile in range(7):
-            self.__move_dict.append(("w", pile))
+    # # Move from foundation to tableau
+    # for suit in ["S", "C", "H", "D"]:
+    #     for col in range(7):
+    #         ret.append(("b", suit, col))
 
-        # Move from waste to foundation
-        self.__move_dict.append(("s",))
+    # Undo move
+    # ret.append(("u",))
 
-        # # Move from foundation to tableau
-        # for suit in ["S", "C", "H", "D"]:
-        #     for col in range(7):
-        #         self.__move_dict.append(("b", suit, col))
+    return ret
 
-        # Undo move
-        # self.__move_dict.append(("u",))
+
+class LegalMoveChecker:
+    # Shared by every instance, as it doesn't depend on the board
+    action_table = build_action_table()
+    action_indices = {move: i for i, move in enumerate(action_table)}
 
     def __init__(self, board: SolitaireBoard):
         self.board = board
 
-        self.__populate_move_dict()
-
     def get_legal_moves(self):
         f_moves = self.check_f_moves()
         w_moves = self.check_w_moves()
@@ -97,41 +101,16 @@ class LegalMoveChecker:
         return ret
 
     def check_f_moves(self):
-        ret = []
-
-        for i in range(7):
-            test_board = deepcopy(self.board)
-            try:
-                test_board.move_to_foundation(i)
-                ret.append(i)
-            except ValueError:
-                continue
-
-        return ret
+        return [i for i in range(7) if self.board.can_move_to_foundation(i)]
 
     def check_w_moves(self):
-        ret = []
-
-        for i in range(7):
-            test_board = deepcopy(self.board)
-            try:
-                test_board.move_from_waste(i)
-                ret.append(i)
-            except ValueError:
-                continue
-
-        return ret
+        return [i for i in range(7) if self.board.can_move_from_waste(i)]
 
     def check_d_moves(self):
         return len(self.board.stock) > 0 or len(self.board.waste) > 0
 
     def check_s_moves(self):
-        test_board = deepcopy(self.board)
-        try:
-            test_board.move_from_waste_to_foundation()
-            return True
-        except ValueError:
-            return False
+        return self.board.can_move_from_waste_to_foundation()
 
     def check_m_moves(self):
         ret = []
@@ -153,12 +132,8 @@ class LegalMoveChecker:
                 col_len = len(self.board.tableau[i])
 
                 for k in range(1, col_len + 1):
-                    test_board = deepcopy(self.board)
-                    try:
-                        test_board.move_within_tableau(i, j, k)
+                    if self.board.can_move_within_tableau(i, j, k):
                         ret.append((i, j, k))
-                    except ValueError:
-                        continue
 
         return ret
 
@@ -167,12 +142,8 @@ class LegalMoveChecker:
 
         for i in ["C", "D", "H", "S"]:
             for j in range(7):
-                test_board = deepcopy(self.board)
-                try:
-                    test_board.move_from_foundation_to_tableau(i, j)
+                if self.board.can_move_from_foundation_to_tableau(i, j):
                     ret.append((i, j))
-                except ValueError:
-                    continue
 
         return ret
 
@@ -180,7 +151,7 @@ class LegalMoveChecker:
         legal_moves = self.get_legal_moves()
 
         ret = []
-        for move in self.__move_dict:
+        for move in self.action_table:
             if move in legal_moves:
                 ret.append(1)
             else:
@@ -189,4 +160,9 @@ class LegalMoveChecker:
         return ret
 
     def decode_move(self, move):
-        return self.__move_dict[move]
+        return self.action_table[move]
+
+    def encode_move(self, move):
+        """Returns the index of the given move in the action table, the inverse
+        of `decode_move`."""
+        return self.action_indices[tuple(move)]
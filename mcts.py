@@ -0,0 +1,226 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import math
+import time
+from copy import deepcopy
+import random
+from solitaire_board import SolitaireBoard
+from dfs import get_search_moves
+
+
+def foundation_score(board: SolitaireBoard):
+    """Returns the fraction of the cards that are in the foundations, which is
+    1 only if the game has been won."""
+    return sum(len(pile) for pile in board.foundations.values()) / 52
+
+
+class MCTSNode:
+    def __init__(
+        self,
+        board: SolitaireBoard,
+        parent=None,
+        move=None,
+        rng: random.Random | None = None,
+    ):
+        """Creates a search tree node for the given board, reached from
+        `parent` by playing `move`. Its moves are tried in an order shuffled
+        with `rng` (the global generator of `random` by default), which is
+        passed down to its children."""
+        self.board = board
+        self.parent = parent
+        self.move = move
+        self.rng = rng
+        self.children = []
+        self.untried_moves = get_search_moves(board)
+        (rng or random).shuffle(self.untried_moves)
+        self.visits = 0
+        self.value = 0.0
+        # Set once every node of the subtree is terminal, so there's nothing
+        # left to learn by visiting it
+        self.exhausted = False
+
+    def is_terminal(self):
+        return len(self.children) == 0 and len(self.untried_moves) == 0
+
+    def update_exhausted(self):
+        """Marks this node as exhausted if it is terminal or all of its
+        children are, propagating the change to its ancestors."""
+        node = self
+        while node is not None and not node.exhausted:
+            if len(node.untried_moves) > 0:
+                break
+            if not all(child.exhausted for child in node.children):
+                break
+
+            node.exhausted = True
+            node = node.parent
+
+    def select_child(self, exploration: float):
+        """Returns the child with the highest UCT value, ignoring exhausted
+        subtrees."""
+        log_visits = math.log(self.visits)
+
+        return max(
+            [child for child in self.children if not child.exhausted],
+            key=lambda child: child.value / child.visits
+            + exploration * math.sqrt(log_visits / child.visits),
+        )
+
+    def expand(self):
+        """Plays one of the untried moves, adding the resulting node as a
+        child."""
+        move = self.untried_moves.pop()
+        board = deepcopy(self.board)
+        board.play_move(move)
+
+        child = MCTSNode(board, self, move, self.rng)
+        self.children.append(child)
+
+        return child
+
+    def moves_from_root(self):
+        """Returns the moves that lead from the root of the tree to this
+        node."""
+        moves = []
+        node = self
+        while node.parent is not None:
+            moves.append(node.move)
+            node = node.parent
+
+        moves.reverse()
+        return moves
+
+
+def rollout(
+    board: SolitaireBoard,
+    max_playout: int,
+    heuristic: bool,
+    deadline: float | None = None,
+    rng: random.Random | None = None,
+):
+    """Plays moves on a copy of the board until the game is won, there are no
+    moves left, `max_playout` moves have been played or the `deadline` (as
+    given by `time.monotonic`) has passed. With `heuristic`, moves to the
+    foundation are always preferred. Moves are chosen with `rng` (the global
+    generator of `random` by default). Returns the moves played and the final
+    score."""
+    board = deepcopy(board)
+    moves = []
+
+    for _ in range(max_playout):
+        if board.check_if_won():
+            break
+
+        if deadline is not None and time.monotonic() >= deadline:
+            break
+
+        legal_moves = get_search_moves(board)
+        if len(legal_moves) == 0:
+            break
+
+        if heuristic:
+            preferred = [move for move in legal_moves if move[0] in ("f", "s")]
+            if len(preferred) > 0:
+                legal_moves = preferred
+
+        move = (rng or random).choice(legal_moves)
+        board.play_move(move)
+        moves.append(move)
+
+    return moves, foundation_score(board)
+
+
+def mcts_search(
+    start_node: SolitaireBoard,
+    time_budget: float = 10.0,
+    exploration: float = 1.4,
+    rollouts_per_leaf: int = 8,
+    max_playout: int = 200,
+    heuristic: bool = True,
+    on_progress=None,
+    rng: random.Random | None = None,
+):
+    """Searches for a solution of the given SolitaireBoard using Monte Carlo
+    tree search with UCT selection. Every expanded leaf is evaluated with a
+    batch of `rollouts_per_leaf` playouts of at most `max_playout` moves, and
+    their mean score is backed up the tree.
+
+    The search stops as soon as a playout wins the game, every node of the tree
+    is terminal or `time_budget` seconds have passed (playouts in progress are
+    cut short). Returns the best line found (the moves that put the
+    most cards in the foundations), its score, which is 1 for a solution, and
+    the number of nodes of the tree. If given, `on_progress` is called with the
+    number of nodes and the current board every 100 nodes. Random choices
+    are made with `rng` (the global generator of `random` by default)."""
+
+    deadline = time.monotonic() + time_budget
+    root = MCTSNode(deepcopy(start_node), rng=rng)
+    nodes = 1
+
+    best_moves = []
+    best_score = foundation_score(start_node)
+
+    if start_node.check_if_won():
+        return best_moves, best_score, nodes
+
+    while time.monotonic() < deadline and not root.exhausted:
+        # Selection
+        node = root
+        while len(node.untried_moves) == 0 and len(node.children) > 0:
+            node = node.select_child(exploration)
+
+        # Expansion
+        if len(node.untried_moves) > 0:
+            node = node.expand()
+            nodes += 1
+
+            if on_progress is not None and nodes % 100 == 0:
+                on_progress(nodes, node.board)
+
+        # Simulation
+        if node.is_terminal() or node.board.check_if_won():
+            results = [([], foundation_score(node.board))]
+            node.update_exhausted()
+        else:
+            # At least one playout is needed to give the node a visit
+            results = []
+            for _ in range(rollouts_per_leaf):
+                results.append(
+                    rollout(node.board, max_playout, heuristic, deadline, rng)
+                )
+
+                if time.monotonic() >= deadline:
+                    break
+
+        for moves, score in results:
+            if score > best_score:
+                best_moves = node.moves_from_root() + moves
+                best_score = score
+
+        if best_score == 1:
+            break
+
+        # Backpropagation
+        total = sum(score for _, score in results)
+        while node is not None:
+            node.visits += len(results)
+            node.value += total
+            node = node.parent
+
+    return best_moves, best_score, nodes
@@ -32,9 +32,12 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import torch
 import torch.nn as nn
 import torch.nn.functional as F
+from observation import N_CARD_INDICES, PADDING_INDEX
 
 
 class QNetwork(nn.Module):
+    # Format of the states taken by the network (see observation.state_formats)
+    state_format = "one-hot"
 
     """
     #################################################
@@ -63,12 +66,15 @@ class QNetwork(nn.Module):
         """
         super(QNetwork, self).__init__()
         self.seed = torch.manual_seed(seed)
-        self.fc1 = nn.Linear(state_size, fc1_units)
+        self.fc1 = self.input_layer(state_size, fc1_units)
         self.fc2 = nn.Linear(fc1_units, fc2_units)
         self.fc3 = nn.Linear(fc2_units, fc3_units)
         self.fc4 = nn.Linear(fc3_units, fc4_units)
         self.fc5 = nn.Linear(fc4_units, action_size)
 
+    def input_layer(self, state_size, units):
+        return nn.Linear(state_size, units)
+
     """
     ###################################################
     Build a network that maps state -> action values.
@@ -81,3 +87,32 @@ class QNetwork(nn.Module):
         x = F.relu(self.fc4(x))
 
         return self.fc5(x)
+
+
+class CardEmbedding(nn.Module):
+    """Layer taking the card indices of a state (see
+    observation.decode_card_indices). It adds up the embeddings of the cards
+    in their slots, which is the same as a linear layer on the one-hot vector
+    of all the (slot, card) pairs, but only reads the rows of the cards on the
+    board."""
+
+    def __init__(self, units):
+        super(CardEmbedding, self).__init__()
+        self.embedding = nn.EmbeddingBag(
+            N_CARD_INDICES + 1, units, mode="sum", padding_idx=PADDING_INDEX
+        )
+        self.bias = nn.Parameter(torch.zeros(units))
+
+    def forward(self, indices):
+        return self.embedding(indices.long()) + self.bias
+
+
+class EmbeddingQNetwork(QNetwork):
+    """QNetwork whose first layer is a CardEmbedding, instead of a linear
+    layer on the one-hot state. Only its first layer is cheaper to evaluate:
+    the other layers are the same as in QNetwork."""
+
+    state_format = "cards"
+
+    def input_layer(self, state_size, units):
+        return CardEmbedding(units)
@@ -0,0 +1,150 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import numpy as np
+from binary_format import DEAL_SIZE, MASK_SIZE, N_CARDS, encode_deal
+from card import Card
+from legal_moves import LegalMoveChecker
+from solitaire_board import SolitaireBoard
+
+"""
+Compact observations of the agent. An observation is a byte array holding the
+deal record of the board (see `binary_format.encode_deal`) followed by its
+legal moves, as a bit-packed mask over the action table of `LegalMoveChecker`.
+It takes OBSERVATION_SIZE bytes, instead of the 4080 values of
+`SolitaireBoard.encode_board`, so the replay memory stores observations and
+only decodes the states of the sampled batches, all at once.
+"""
+
+ACTION_SIZE = len(LegalMoveChecker.action_table)
+LEGAL_MASK_SIZE = (ACTION_SIZE + 7) // 8
+OBSERVATION_SIZE = DEAL_SIZE + LEGAL_MASK_SIZE
+
+# Slots of `SolitaireBoard.encode_board`: 24 for the stock, 24 for the waste, 13
+# for every foundation and 20 for every tableau column
+N_SLOTS = 240
+CARD_FEATURES = 17
+STATE_SIZE = N_SLOTS * CARD_FEATURES
+
+# Card id of the empty slots (cards have the ids 0 to 51 of `Card.compact`)
+EMPTY = N_CARDS
+
+# Card indices: every card in every slot has its own index, and empty slots
+# have PADDING_INDEX
+N_CARD_INDICES = N_SLOTS * N_CARDS
+PADDING_INDEX = N_CARD_INDICES
+
+# Piles of the deal records, in the order of `binary_format.board_piles`
+pile_indices = {"stock": 0, "waste": 1}
+pile_indices.update({suit: 2 + i for i, suit in enumerate(Card.suits)})
+
+
+def build_slots():
+    """Returns the pile of the deal record and the position in the pile of the
+    card of every slot."""
+    piles = [(pile_indices["stock"], 24), (pile_indices["waste"], 24)]
+    piles += [(pile_indices[suit], 13) for suit in ["S", "C", "H", "D"]]
+    piles += [(6 + col, 20) for col in range(7)]
+
+    slot_piles = [pile for pile, size in piles for _ in range(size)]
+    slot_positions = [i for _, size in piles for i in range(size)]
+
+    return np.array(slot_piles), np.array(slot_positions)
+
+
+slot_piles, slot_positions = build_slots()
+
+# Features of every card id (as in `Card.encode`), and zeros for EMPTY
+card_features = np.zeros((N_CARDS + 1, CARD_FEATURES), dtype=np.uint8)
+for i in range(N_CARDS):
+    card = Card.from_compact(i)
+    card_features[i] = card.encode()
+
+
+def encode_observation(board: SolitaireBoard, legal_moves: list | None = None):
+    """Returns the observation of the given board. The legal moves of the
+    board are computed if not given."""
+    if legal_moves is None:
+        legal_moves = LegalMoveChecker(board).get_legal_moves()
+
+    mask = np.zeros(ACTION_SIZE, dtype=np.uint8)
+    for move in legal_moves:
+        mask[LegalMoveChecker.action_indices[move]] = 1
+
+    ret = np.empty(OBSERVATION_SIZE, dtype=np.uint8)
+    ret[:DEAL_SIZE] = np.frombuffer(encode_deal(board), dtype=np.uint8)
+    ret[DEAL_SIZE:] = np.packbits(mask)
+
+    return ret
+
+
+def decode_cards(observations: np.ndarray):
+    """Returns the card id of every slot of the given observations (a 2D
+    array, one observation per row), or EMPTY for empty slots."""
+    permutations = observations[:, :N_CARDS]
+    lengths = observations[:, N_CARDS + MASK_SIZE : DEAL_SIZE].astype(np.int64)
+    offsets = np.cumsum(lengths, axis=1) - lengths
+
+    used = slot_positions < lengths[:, slot_piles]
+    positions = np.where(used, offsets[:, slot_piles] + slot_positions, 0)
+    cards = np.take_along_axis(permutations, positions, axis=1)
+
+    return np.where(used, cards, EMPTY)
+
+
+def decode_states(observations: np.ndarray, out: np.ndarray = None):
+    """Returns the states of the given observations, as the one-hot vectors of
+    `SolitaireBoard.encode_board` (one per row). They are written to `out` (a
+    contiguous uint8 array with a row per observation) if it's given."""
+    cards = decode_cards(observations)
+    if out is None:
+        return card_features[cards].reshape(len(observations), STATE_SIZE)
+
+    np.take(card_features, cards, axis=0, out=out.reshape(cards.shape + (-1,)))
+    return out
+
+
+def decode_card_indices(observations: np.ndarray, out: np.ndarray = None):
+    """Returns the states of the given observations as the card index of
+    every slot (one row of N_SLOTS indices per observation), a sparse
+    alternative to `decode_states`. They are written to `out` if it's given."""
+    cards = decode_cards(observations)
+    indices = np.where(
+        cards == EMPTY, PADDING_INDEX, np.arange(N_SLOTS) * N_CARDS + cards
+    )
+
+    if out is None:
+        return indices.astype(np.int16)
+
+    out[...] = indices
+    return out
+
+
+# Formats of the states given to the networks (see `model.QNetwork`): the
+# function decoding them from observations, and their size and type
+state_formats = {
+    "one-hot": (decode_states, STATE_SIZE, np.uint8),
+    "cards": (decode_card_indices, N_SLOTS, np.int16),
+}
+
+
+def decode_legal_masks(observations: np.ndarray):
+    """Returns the legal moves of the given observations, as a boolean mask
+    over the action table (one per row)."""
+    masks = np.unpackbits(observations[:, DEAL_SIZE:], axis=1, count=ACTION_SIZE)
+    return masks.astype(bool)
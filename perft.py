@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import json
+import sys
+import time
+from copy import deepcopy
+from legal_moves import LegalMoveChecker
+from solitaire_board import SolitaireBoard
+
+"""
+This script counts the positions reachable from a board in a given number of
+moves, like the perft function of chess engines. Every legal move returned by
+`LegalMoveChecker` is played on a copy of the board, the same way the solvers
+do, so the counts check the move generator and `SolitaireBoard` together, and
+the time it takes measures their speed.
+
+The counts of a board and depth never change unless the rules do, so after
+optimizing the engine they must stay the same (see `--expect`).
+"""
+
+
+def perft(board: SolitaireBoard, depth: int):
+    """Returns the number of leaf positions reached by playing every sequence
+    of `depth` legal moves from the given board (paths to the same position
+    are counted separately)."""
+    if depth == 0:
+        return 1
+
+    legal_moves = LegalMoveChecker(board).get_legal_moves()
+    if depth == 1:
+        return len(legal_moves)
+
+    nodes = 0
+    for move in legal_moves:
+        new_board = deepcopy(board)
+        new_board.play_move(move)
+        nodes += perft(new_board, depth - 1)
+
+    return nodes
+
+
+def divide(board: SolitaireBoard, depth: int):
+    """Returns a list with every legal move of the board and the number of leaf
+    positions reached through it (their sum is `perft(board, depth)`)."""
+    ret = []
+
+    for move in LegalMoveChecker(board).get_legal_moves():
+        new_board = deepcopy(board)
+        new_board.play_move(move)
+        ret.append((move, perft(new_board, depth - 1)))
+
+    return ret
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Counts the positions reachable in a number of moves"
+    )
+    parser.add_argument("depth", type=int, help="number of moves")
+    parser.add_argument("board", nargs="?", help="board to start from (JSON)")
+    parser.add_argument(
+        "--deal", type=int, default=0, help="numbered deal to start from"
+    )
+    parser.add_argument(
+        "--divide",
+        action="store_true",
+        help="print the count of every move of the starting board",
+    )
+    parser.add_argument(
+        "--expect",
+        type=int,
+        default=None,
+        help="exit with an error if the count is not this one",
+    )
+    args = parser.parse_args()
+
+    if args.depth < 1:
+        parser.error("the depth must be at least 1")
+
+    if args.board is not None:
+        with open(args.board, "r") as f:
+            board = SolitaireBoard.generate_from_json(json.load(f))
+    else:
+        board = SolitaireBoard.generate_from_number(args.deal)
+
+    start = time.perf_counter()
+
+    if args.divide:
+        subtotals = divide(board, args.depth)
+        for move, count in subtotals:
+            print(f"{move}: {count}")
+        nodes = sum(count for _, count in subtotals)
+    else:
+        nodes = perft(board, args.depth)
+
+    elapsed = time.perf_counter() - start
+
+    print("Nodes:", nodes)
+    print(f"Time: {elapsed:.2f} s")
+    print(f"Nodes/s: {nodes / elapsed if elapsed > 0 else 0:.0f}")
+
+    if args.expect is not None and nodes != args.expect:
+        print(f"Expected {args.expect} nodes", file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -8,29 +8,87 @@ Code expanded and adapted from code examples provided by Udacity DRL Team, 2018.
 """
 
 # Import Required Packages
+import queue
+import threading
+import time
 import torch
 import numpy as np
-import random
-from collections import namedtuple, deque
-from model import QNetwork
+from multiprocessing import shared_memory
+from observation import OBSERVATION_SIZE, decode_legal_masks, state_formats
 
 # Determine if CPU or GPU computation should be used
 device = torch.device("cuda:0" if torch.cuda.is_available() else "cpu")
 
 
+def states_to_tensor(states, device):
+    """Copy decoded states to the device. One-hot states are converted to
+    floats there; card indices are left as integers."""
+    # Copies from pinned buffers don't block
+    tensor = torch.from_numpy(states).to(device, non_blocking=True)
+    if states.dtype == np.uint8:
+        tensor = tensor.float()
+
+    return tensor
+
+
+def to_tensors(experiences, state_format="one-hot", buffers=None):
+    """Convert experiences returned by ReplayBuffer.sample_arrays to tensors,
+    decoding their states in the given format (into the given pair of
+    tensors, if any, which must have at least a row per experience). The
+    legal moves of the next states, unpacked from their observations, follow
+    the experiences."""
+    states, actions, rewards, next_states, dones = experiences[:5]
+    decode = state_formats[state_format][0]
+
+    if buffers is None:
+        buffers = (None, None)
+    else:
+        buffers = tuple(buffer[: len(states)].numpy() for buffer in buffers)
+
+    # The gathers and the decoding are the only copies; the tensors share
+    # their memory, and states are converted once on the device
+    states = states_to_tensor(decode(states, buffers[0]), device)
+    actions = torch.from_numpy(actions).to(device)
+    rewards = torch.from_numpy(rewards).to(device)
+    next_states = states_to_tensor(decode(next_states, buffers[1]), device)
+    dones = torch.from_numpy(dones).to(device)
+
+    # Used to only take the maximum over legal actions in the targets
+    next_legal = torch.from_numpy(decode_legal_masks(experiences[3])).to(device)
+
+    tensors = (states, actions, rewards, next_states, dones, next_legal)
+
+    # Importance-sampling weights and indices of prioritized batches
+    if len(experiences) > 5:
+        weights, indices = experiences[5:]
+        tensors += (torch.from_numpy(weights).to(device), indices)
+
+    return tensors
+
+
 """
 ##################################################
 ReplayBuffer Class
 Defines  a Replay Memeory Buffer for a DQN or DDQN agent
 The buffer holds memories of: [sate, action reward, next sate, done] tuples
 Random batches of replay memories are sampled for learning. 
+
+The memories are kept in preallocated arrays used as ring buffers, so adding a
+memory only copies its values into the arrays, and sampling a batch is a single
+gather per array. States are given as compact observations (see
+observation.py) and stored once in an array of observations: every memory holds
+the indices of its state and its next state, and the state of a memory is
+usually the next state of the previous one, which is not stored again. Only the
+states of the sampled batch are decoded to one-hot vectors.
 """
 
 
 class ReplayBuffer:
     """Fixed-size buffer to store experience tuples."""
 
-    def __init__(self, action_size, buffer_size, batch_size, seed):
+    def __init__(
+        self, action_size, buffer_size, batch_size, seed, state_format="one-hot"
+    ):
         """Initialize a ReplayBuffer object.
 
         Params
@@ -39,62 +97,514 @@ class ReplayBuffer:
             buffer_size (int): maximum size of buffer
             batch_size (int): size of each training batch
             seed (int): random seed
+            state_format (str): format of the sampled states (see
+                observation.state_formats)
         """
         self.action_size = action_size
-        self.memory = deque(maxlen=buffer_size)
+        self.buffer_size = buffer_size
         self.batch_size = batch_size
-        self.experience = namedtuple(
-            "Experience",
-            field_names=["state", "action", "reward", "next_state", "done"],
-        )
-        self.seed = random.seed(seed)
+        self.state_format = state_format
+        self.rng = np.random.default_rng(seed)
+
+        # The first state of every episode takes an extra observation, so there
+        # are more observations than memories. Memories whose state has been
+        # overwritten anyway are not sampled
+        self.observations_size = buffer_size + buffer_size // 16 + 1
+
+        # Number and values of the last next state of every stream of
+        # memories (e.g. every board of a VectorEnv), to detect when it's the
+        # state of the following memory of the stream
+        self.last_next_states = {}
+
+        # Held while adding and sampling, as a Prefetcher samples from another
+        # thread
+        self.lock = threading.RLock()
+
+        self.create_arrays()
 
-    def add(self, state, action, reward, next_state, done):
-        """Add a new experience to memory."""
-        e = self.experience(state, action, reward, next_state, done)
-        self.memory.append(e)
+    def array_specs(self):
+        """Return the name, shape and type of every array of the buffer."""
+        return [
+            ("observations", (self.observations_size, OBSERVATION_SIZE), np.uint8),
+            ("state_numbers", (self.buffer_size,), np.int64),
+            ("next_state_numbers", (self.buffer_size,), np.int64),
+            ("actions", (self.buffer_size, 1), np.int64),
+            ("rewards", (self.buffer_size, 1), np.float32),
+            ("dones", (self.buffer_size, 1), np.float32),
+        ]
+
+    def create_arrays(self):
+        """Allocate the arrays of the buffer and reset its counters."""
+        for name, shape, dtype in self.array_specs():
+            setattr(self, name, np.zeros(shape, dtype=dtype))
+
+        # Number of observations ever written (the observation with number n is
+        # stored in the slot n % observations_size)
+        self.observations_written = 0
+
+        # Slot of the next memory and number of memories stored
+        self.position = 0
+        self.size = 0
+
+    def add_observation(self, state):
+        """Stores a state, returning its number."""
+        number = self.observations_written
+        self.observations[number % self.observations_size] = state
+        self.observations_written += 1
+
+        return number
+
+    def add(self, state, action, reward, next_state, done, stream=0):
+        """Add a new experience to memory. Experiences played one after the
+        other must be added with the same stream."""
+        with self.lock:
+            self.store(state, action, reward, next_state, done, stream)
+
+    def store(self, state, action, reward, next_state, done, stream):
+        last_number, last_next_state = self.last_next_states.get(stream, (-1, None))
+        oldest = self.observations_written - self.observations_size
+
+        if (
+            last_next_state is not None
+            and last_number >= oldest
+            and (state is last_next_state or np.array_equal(state, last_next_state))
+        ):
+            state_number = last_number
+        else:
+            state_number = self.add_observation(state)
+
+        next_state_number = self.add_observation(next_state)
+        self.last_next_states[stream] = (next_state_number, next_state)
+
+        i = self.position
+        self.state_numbers[i] = state_number
+        self.next_state_numbers[i] = next_state_number
+        self.actions[i] = action
+        self.rewards[i] = reward
+        self.dones[i] = done
+
+        self.position = (self.position + 1) % self.buffer_size
+        self.size = min(self.size + 1, self.buffer_size)
+
+    def sample_indices(self, n=None):
+        """Randomly choose the memories of a batch (of n memories, or
+        batch_size by default)."""
+        indices = self.rng.integers(0, self.size, n or self.batch_size)
+
+        # Replace the memories whose state has been overwritten (the newest
+        # memory is always valid, so this ends)
+        oldest = self.observations_written - self.observations_size
+        invalid = self.state_numbers[indices] < oldest
+        while invalid.any():
+            indices[invalid] = self.rng.integers(0, self.size, invalid.sum())
+            invalid = self.state_numbers[indices] < oldest
+
+        return indices
 
     def sample(self):
         """Randomly sample a batch of experiences from memory."""
-        experiences = random.sample(self.memory, k=self.batch_size)
-        states = (
-            torch.from_numpy(np.vstack([e.state for e in experiences if e is not None]))
-            .float()
-            .to(device)
-        )
-        actions = (
-            torch.from_numpy(
-                np.vstack([e.action for e in experiences if e is not None])
-            )
-            .long()
-            .to(device)
-        )
-        rewards = (
-            torch.from_numpy(
-                np.vstack([e.reward for e in experiences if e is not None])
-            )
-            .float()
-            .to(device)
-        )
-        next_states = (
-            torch.from_numpy(
-                np.vstack([e.next_state for e in experiences if e is not None])
-            )
-            .float()
-            .to(device)
+        return to_tensors(self.sample_arrays(), self.state_format)
+
+    def sample_arrays(self):
+        """Randomly sample a batch of experiences, as arrays (see
+        gather_arrays)."""
+        return self.gather_arrays(self.sample_indices())
+
+    def gather_arrays(self, indices):
+        """Return the experiences with the given indices, as arrays (with the
+        observations of their states, not yet decoded)."""
+        state_slots = self.state_numbers[indices] % self.observations_size
+        next_state_slots = self.next_state_numbers[indices] % self.observations_size
+
+        return (
+            self.observations[state_slots],
+            self.actions[indices],
+            self.rewards[indices],
+            self.observations[next_state_slots],
+            self.dones[indices],
         )
-        dones = (
-            torch.from_numpy(
-                np.vstack([e.done for e in experiences if e is not None]).astype(
-                    np.uint8
-                )
-            )
-            .float()
-            .to(device)
+
+    def __len__(self):
+        """Return the current size of internal memory."""
+        return self.size
+
+
+"""
+##################################################
+SumTree Class
+Binary tree stored in an array, where every leaf holds the priority of a memory
+and every other node the sum of its children, so the root holds the total
+priority. Updating a priority and finding the memory at a given point of the
+cumulative priorities take O(log n); both are done for a whole batch at once.
+"""
+
+
+class SumTree:
+    def __init__(self, capacity):
+        """Initialize a SumTree with (at least) the given number of leaves."""
+        self.capacity = 1
+        while self.capacity < capacity:
+            self.capacity *= 2
+
+        # Node i has the children 2i and 2i + 1; the leaves start at capacity
+        self.tree = np.zeros(2 * self.capacity, dtype=np.float64)
+
+    def total(self):
+        return self.tree[1]
+
+    def max_leaf(self):
+        return self.tree[self.capacity :].max()
+
+    def update(self, indices, priorities):
+        """Set the priorities of the leaves with the given indices."""
+        nodes = np.asarray(indices) + self.capacity
+        self.tree[nodes] = priorities
+
+        # All the leaves are at the same depth, so the nodes updated at every
+        # step are at the same level, up to the root
+        nodes = np.unique(nodes // 2)
+        while nodes[0] >= 1:
+            self.tree[nodes] = self.tree[2 * nodes] + self.tree[2 * nodes + 1]
+            nodes = np.unique(nodes // 2)
+
+    def find(self, values):
+        """Return the indices of the leaves where the given cumulative
+        priorities fall."""
+        nodes = np.ones(len(values), dtype=np.int64)
+        values = np.array(values, dtype=np.float64)
+
+        while nodes[0] < self.capacity:
+            left = 2 * nodes
+            right = values >= self.tree[left]
+            values -= self.tree[left] * right
+            nodes = left + right
+
+        return nodes - self.capacity
+
+
+"""
+##################################################
+PrioritizedReplayBuffer Class
+Replay memory where memories are sampled with a probability proportional to
+their priority (their last TD error) raised to alpha, instead of uniformly, so
+rare memories with large errors (wins, moves to the foundations) are replayed
+more often. The bias this introduces is corrected with importance-sampling
+weights, whose exponent beta grows linearly from its initial value to 1.
+"""
+
+
+class PrioritizedReplayBuffer(ReplayBuffer):
+    def __init__(
+        self,
+        action_size,
+        buffer_size,
+        batch_size,
+        seed,
+        alpha=0.6,
+        beta=0.4,
+        beta_steps=100_000,
+        priority_eps=1e-5,
+        state_format="one-hot",
+    ):
+        """Initialize a PrioritizedReplayBuffer object.
+
+        Params
+        ======
+            alpha (float): how much the priorities are used (0 is uniform)
+            beta (float): initial exponent of the importance-sampling weights
+            beta_steps (int): number of batches until beta reaches 1
+            priority_eps (float): added to the errors, so no memory has a null
+                probability
+        """
+        super().__init__(action_size, buffer_size, batch_size, seed, state_format)
+
+        self.alpha = alpha
+        self.beta = beta
+        self.beta_increment = (1.0 - beta) / beta_steps
+        self.priority_eps = priority_eps
+
+        self.tree = SumTree(buffer_size)
+        self.max_priority = 1.0
+
+    def store(self, state, action, reward, next_state, done, stream):
+        """Store a new experience, with the highest priority so far."""
+        i = self.position
+        super().store(state, action, reward, next_state, done, stream)
+        self.tree.update([i], self.max_priority)
+
+    def sample_indices(self):
+        """Choose the memories of a batch, one in each of batch_size equal
+        segments of the cumulative priorities."""
+        segment = self.tree.total() / self.batch_size
+        offsets = self.rng.random(self.batch_size)
+        indices = self.tree.find((np.arange(self.batch_size) + offsets) * segment)
+
+        # Memories whose state has been overwritten are removed from the tree.
+        # Rounding errors may also land on an empty leaf; both are resampled
+        oldest = self.observations_written - self.observations_size
+        invalid = self.invalid_indices(indices, oldest)
+        while invalid.any():
+            overwritten = indices[invalid]
+            overwritten = overwritten[self.state_numbers[overwritten] < oldest]
+            if len(overwritten) > 0:
+                self.tree.update(np.unique(overwritten), 0.0)
+
+            values = self.rng.random(invalid.sum()) * self.tree.total()
+            indices[invalid] = self.tree.find(values)
+            invalid = self.invalid_indices(indices, oldest)
+
+        return indices
+
+    def invalid_indices(self, indices, oldest):
+        empty = self.tree.tree[indices + self.tree.capacity] == 0
+        return empty | (self.state_numbers[indices] < oldest)
+
+    def sample_arrays(self):
+        """Sample a batch of experiences by priority. Besides the experiences,
+        return their importance-sampling weights and their indices, to update
+        their priorities after learning."""
+        indices = self.sample_indices()
+        experiences = self.gather_arrays(indices)
+
+        priorities = self.tree.tree[indices + self.tree.capacity]
+        probabilities = priorities / self.tree.total()
+        weights = (self.size * probabilities) ** -self.beta
+        weights /= weights.max()
+        self.beta = min(1.0, self.beta + self.beta_increment)
+
+        weights = weights.astype(np.float32)[:, np.newaxis]
+
+        return experiences + (weights, indices)
+
+    def update_priorities(self, indices, errors):
+        """Set the priorities of the given memories from their TD errors. With
+        a Prefetcher, other memories may have been added since the batch was
+        sampled; the priorities of the ones that were overwritten are lost."""
+        priorities = (np.abs(errors) + self.priority_eps) ** self.alpha
+        with self.lock:
+            self.tree.update(indices, priorities)
+            self.max_priority = max(self.max_priority, priorities.max())
+
+
+"""
+##################################################
+SharedReplaySegment Class
+Replay memory whose arrays and counters live in a block of shared memory, so a
+process (an actor) can add experiences while others (the learner) sample them.
+Every segment has a single writer; the learner samples from all the segments at
+once through a SharedReplayBuffer. A segment is sent to other processes by the
+name of its block, which they attach to.
+"""
+
+
+class SharedReplaySegment(ReplayBuffer):
+    # Memories right after the position, which the writer overwrites next, are
+    # not sampled
+    write_margin = 64
+
+    def __init__(self, action_size, buffer_size, batch_size, seed, name=None):
+        """Initialize a SharedReplaySegment object, creating its block of
+        shared memory (or attaching to the block with the given name)."""
+        self.name = name
+        super().__init__(action_size, buffer_size, batch_size, seed)
+
+    def create_arrays(self):
+        specs = self.array_specs() + [("counters", (3,), np.int64)]
+
+        offsets = []
+        total = 0
+        for _, shape, dtype in specs:
+            offsets.append(total)
+            size = int(np.prod(shape)) * np.dtype(dtype).itemsize
+            total += (size + 7) // 8 * 8
+
+        # New blocks are filled with zeros
+        if self.name is None:
+            self.block = shared_memory.SharedMemory(create=True, size=total)
+            self.name = self.block.name
+        else:
+            self.block = shared_memory.SharedMemory(name=self.name)
+
+        for (name, shape, dtype), offset in zip(specs, offsets):
+            array = np.ndarray(shape, dtype=dtype, buffer=self.block.buf, offset=offset)
+            setattr(self, name, array)
+
+    # The counters are shared too: observations written, position and size
+    @property
+    def observations_written(self):
+        return int(self.counters[0])
+
+    @observations_written.setter
+    def observations_written(self, value):
+        self.counters[0] = value
+
+    @property
+    def position(self):
+        return int(self.counters[1])
+
+    @position.setter
+    def position(self, value):
+        self.counters[1] = value
+
+    @property
+    def size(self):
+        return int(self.counters[2])
+
+    @size.setter
+    def size(self, value):
+        self.counters[2] = value
+
+    def __reduce__(self):
+        return (
+            SharedReplaySegment,
+            (self.action_size, self.buffer_size, self.batch_size, None, self.name),
         )
 
-        return (states, actions, rewards, next_states, dones)
+    def sample_indices(self, n=None):
+        """Randomly choose memories, skipping the ones being overwritten."""
+        size = self.size
+        n = n or self.batch_size
+
+        if size < self.buffer_size or size <= self.write_margin:
+            indices = self.rng.integers(0, size, n)
+        else:
+            start = self.position + self.write_margin
+            indices = start + self.rng.integers(0, size - self.write_margin, n)
+            indices %= self.buffer_size
+
+        # Memories whose state was overwritten are dropped
+        oldest = self.observations_written - self.observations_size
+        return indices[self.state_numbers[indices] >= oldest]
+
+    def close(self, unlink=False):
+        """Detach from the block of shared memory (and free it, if unlink is
+        set; only its creator should do it)."""
+        for name, _, _ in self.array_specs():
+            setattr(self, name, None)
+        self.counters = None
+
+        self.block.close()
+        if unlink:
+            self.block.unlink()
+
+
+class SharedReplayBuffer:
+    """Samples batches from several SharedReplaySegments, in proportion to
+    their sizes."""
+
+    def __init__(self, segments, batch_size, seed, state_format="one-hot"):
+        self.segments = segments
+        self.batch_size = batch_size
+        self.state_format = state_format
+        self.rng = np.random.default_rng(seed)
+        self.lock = threading.RLock()
+
+    def sample(self):
+        return to_tensors(self.sample_arrays(), self.state_format)
+
+    def sample_arrays(self):
+        sizes = np.array([len(segment) for segment in self.segments])
+        counts = self.rng.multinomial(self.batch_size, sizes / sizes.sum())
+
+        parts = [
+            segment.gather_arrays(segment.sample_indices(count))
+            for segment, count in zip(self.segments, counts)
+            if count > 0
+        ]
+
+        return tuple(np.concatenate(arrays) for arrays in zip(*parts))
 
     def __len__(self):
-        """Return the current size of internal memory."""
-        return len(self.memory)
+        return sum(len(segment) for segment in self.segments)
+
+
+"""
+##################################################
+Prefetcher Class
+Samples batches from a replay memory in a background thread, keeping a queue of
+batches ready as tensors, so the agent doesn't wait for the sampling, the
+decoding of the states and their copy to the device when it learns. The states
+are decoded into buffers that are reused (and pinned when training on a GPU, so
+their copy to it doesn't block).
+
+The batches in the queue were sampled before the last memories were added,
+and with prioritized replay, before the priorities of the batches learned in
+the meantime were updated.
+"""
+
+
+class Prefetcher:
+    def __init__(self, memory, depth=2):
+        """Start sampling batches from the given memory (a ReplayBuffer,
+        PrioritizedReplayBuffer or SharedReplayBuffer), up to `depth` batches
+        ahead."""
+        self.memory = memory
+        self.queue = queue.Queue(maxsize=depth)
+        self.stopped = threading.Event()
+
+        # A buffer is reused when its batch has left the queue, once the copy
+        # of its states to the device is done: depth batches may be queued, one
+        # being learned and one being sampled
+        _, size, dtype = state_formats[memory.state_format]
+        self.buffers = [
+            tuple(self.new_buffer((memory.batch_size, size), dtype) for _ in range(2))
+            for _ in range(depth + 2)
+        ]
+        self.copies = [None] * len(self.buffers)
+
+        self.thread = threading.Thread(target=self.run, daemon=True)
+        self.thread.start()
+
+    def new_buffer(self, shape, dtype):
+        buffer = torch.from_numpy(np.zeros(shape, dtype=dtype))
+        if device.type == "cuda":
+            buffer = buffer.pin_memory()
+
+        return buffer
+
+    def run(self):
+        slot = 0
+        try:
+            while not self.stopped.is_set():
+                if len(self.memory) <= self.memory.batch_size:
+                    time.sleep(0.01)
+                    continue
+
+                with self.memory.lock:
+                    arrays = self.memory.sample_arrays()
+
+                if self.copies[slot] is not None:
+                    self.copies[slot].synchronize()
+
+                batch = to_tensors(arrays, self.memory.state_format, self.buffers[slot])
+
+                if device.type == "cuda":
+                    self.copies[slot] = torch.cuda.Event()
+                    self.copies[slot].record()
+
+                slot = (slot + 1) % len(self.buffers)
+                self.put(batch)
+        except Exception as error:
+            # Raised by get()
+            self.put(error)
+
+    def put(self, item):
+        while not self.stopped.is_set():
+            try:
+                self.queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def get(self):
+        """Return the next batch, waiting for it if none is ready."""
+        batch = self.queue.get()
+        if isinstance(batch, Exception):
+            raise batch
+
+        return batch
+
+    def close(self):
+        """Stop sampling. Must be called before closing a shared memory."""
+        self.stopped.set()
+        self.thread.join()
@@ -41,10 +41,10 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import torch
 import time
 import random
-import numpy as np
 from dqn_agent import Agent
 from legal_moves import LegalMoveChecker
 from solitaire_board import SolitaireBoard
+from observation import encode_observation
 import sys
 
 """
@@ -134,12 +134,19 @@ if len(sys.argv) != 3:
 weights_path = sys.argv[1]
 seed = random.randint(1, 2**31 - 1)
 
-# Initialize Agent
-agent = Agent(state_size=state_size, action_size=action_size, seed=seed)
+weights = torch.load(weights_path)
+
+# Initialize Agent (with the network the weights were trained with)
+agent = Agent(
+    state_size=state_size,
+    action_size=action_size,
+    seed=seed,
+    embedding="fc1.embedding.weight" in weights,
+)
 
 
 # Load trained model weights
-agent.network.load_state_dict(torch.load(weights_path))
+agent.network.load_state_dict(weights)
 
 """
 ###################################
@@ -154,7 +161,7 @@ for i_episode in range(1, num_episodes + 1):
     legal_checker = LegalMoveChecker(env)
 
     # get initial state of the unity environment
-    state = env.encode_board()
+    state = encode_observation(env)
 
     # set the initial episode score to zero.
     score = 0
@@ -186,9 +193,7 @@ for i_episode in range(1, num_episodes + 1):
         # wait for key press
         input("Press Enter to continue...")
 
-        next_state = np.hstack(
-            (env.encode_board(), legal_checker.encode_legal_moves())
-        )  # get the next state
+        next_state = encode_observation(env)  # get the next state
         # reward = env_info.rewards[0]  # get the reward
         done = env.check_if_won()  # see if episode has finished
 
@@ -41,16 +41,64 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 
 ###################################
 # Import Required Packages
-import json
-import sys
+import argparse
 import torch
 import time
 import random
 import numpy as np
-from collections import deque
 from dqn_agent import Agent
 from legal_moves import LegalMoveChecker
 from solitaire_board import SolitaireBoard
+from deal_corpus import load_boards, parse_deal_range
+from observation import encode_observation
+from vector_env import VectorEnv
+import actor_learner
+
+parser = argparse.ArgumentParser(description="Trains a DQN agent")
+parser.add_argument(
+    "--deals",
+    default=None,
+    help="train with the numbered deals of a range, as <start>:<stop>",
+)
+parser.add_argument(
+    "--prioritized",
+    action="store_true",
+    help="sample the replay memory by priority instead of uniformly",
+)
+parser.add_argument(
+    "--envs",
+    type=int,
+    default=1,
+    help="number of boards played at once, choosing the moves of all of them "
+    "with a single forward pass of the network (default: %(default)s)",
+)
+parser.add_argument(
+    "--actors",
+    type=int,
+    default=0,
+    help="number of actor processes playing episodes while this process only "
+    "trains the network (by default, a single process does both)",
+)
+parser.add_argument(
+    "--prefetch",
+    type=int,
+    default=0,
+    help="number of batches sampled ahead in a background thread, so learning "
+    "doesn't wait for them (by default, they are sampled when learning)",
+)
+parser.add_argument(
+    "--embedding",
+    action="store_true",
+    help="use a network whose first layer adds up embeddings of the cards of "
+    "the board, instead of a dense layer on its one-hot encoding",
+)
+parser.add_argument(
+    "boards", nargs="*", help="boards to train with (JSON files or a deal corpus)"
+)
+args = parser.parse_args()
+
+if args.actors > 0 and args.prioritized:
+    parser.error("--prioritized can't be used with --actors")
 
 """
 ###################################
@@ -153,7 +201,15 @@ Here we initialize an agent using the Unity environments state and action size d
 and the default DQN hyperparameter settings.
 """
 seed = random.randint(1, 2**31 - 1)
-agent = Agent(state_size=state_size, action_size=action_size, dqn_type="DQN", seed=seed)
+agent = Agent(
+    state_size=state_size,
+    action_size=action_size,
+    dqn_type="DQN",
+    seed=seed,
+    prioritized=args.prioritized,
+    prefetch=args.prefetch,
+    embedding=args.embedding,
+)
 
 # Save seed for reproducibility
 timestr = time.strftime("%Y%m%d-%H%M%S")
@@ -187,151 +243,204 @@ That is, if the average score for the previous 100 episodes is greater than solv
 """
 
 won_games = 0
-boards = []
+# Deals to train with, or None to use random ones
+boards = None
 
-if len(sys.argv) > 1:
-    json_files = sys.argv[1:]
-    boards = []
+if args.deals is not None:
+    # A range of numbered deals, generated as they are played
+    try:
+        boards = parse_deal_range(args.deals)
+    except ValueError as e:
+        parser.error(str(e))
 
-    for json_file in json_files:
-        with open(json_file, "r") as f:
-            board_json = f.read()
-            board_json = json.loads(board_json)
-
-        boards.append(SolitaireBoard.generate_from_json(board_json))
+    num_episodes = len(boards)
+elif len(args.boards) > 0:
+    # JSON files or a deal corpus, whose deals are decoded as they are played
+    boards = load_boards(args.boards)
 
     num_episodes = len(boards)
 
-try:
-    # create log file
+
+def save_agent():
+    # Save trained neural network weights
     timestr = time.strftime("%Y%m%d-%H%M%S")
-    log_file = open(f"score-{timestr}.csv", "w")
+    nn_filename = "dqnAgent_Trained_Model_" + timestr + ".pth"
+    torch.save(agent.network.state_dict(), nn_filename)
+
+    # Save the recorded Scores data
+    scores_filename = "dqnAgent_scores_" + timestr + ".csv"
+    np.savetxt(scores_filename, scores, delimiter=",")
+
+
+def finish_episode(i_episode, score):
+    """Records the score of a finished episode and decays epsilon. Returns
+    True (after saving the agent) if the training is finished."""
+    global epsilon
+
+    # Add episode score to Scores and...
+    # Calculate mean score over last 100 episodes
+    # Mean score is calculated over current episodes until i_episode > 100
+    scores.append(score)
+    average_score = np.mean(
+        scores[i_episode - min(i_episode, scores_average_window) : i_episode + 1]
+    )
+
+    # Decrease epsilon for epsilon-greedy policy by decay rate
+    # Use max method to make sure epsilon doesn't decrease below epsilon_min
+    epsilon = max(epsilon_min, epsilon_decay * epsilon)
+
+    # (Over-) Print current average score
+    print("{},{:.2f},{:.2f}".format(i_episode, average_score, won_games / i_episode))
 
-    # loop from num_episodes
-    for i_episode in range(1, num_episodes + 1):
-        # reset the unity environment at the beginning of each episode
-        # env_info = env.reset(train_mode=True)[brain_name]
-        env = (
-            boards[i_episode - 1]
-            if len(sys.argv) > 1
-            else SolitaireBoard.generate_random()
+    # Write to log file
+    log_file.write(
+        "{},{:.2f},{:.2f}\n".format(i_episode, average_score, won_games / i_episode)
+    )
+
+    # Flush log file
+    log_file.flush()
+
+    # Check to see if the task is solved (i.e,. avearge_score > solved_score).
+    # If yes, save the network weights and scores and end training.
+    if won_games / i_episode > 0.75:
+        print(
+            "\nEnvironment solved in {:d} episodes!\tAverage Score: {:.2f}".format(
+                i_episode, average_score
+            )
         )
-        legal_checker = LegalMoveChecker(env)
-
-        # get initial state of the unity environment
-        # state = env_info.vector_observations[0]
-        state = env.encode_board()
-
-        # set the initial episode score to zero.
-        score = 0
-
-        # Run the episode training loop;
-        # At each loop step take an epsilon-greedy action as a function of the current state observations
-        # Based on the resultant environmental state (next_state) and reward received update the Agent network
-        # If environment episode is done, exit loop...
-        # Otherwise repeat until done == true
-        i = 0
-        while True:
-            # Clear screen (ANSI escape code)
-            print("\033[2J\033[H", end="")
-            print((i, score, legal_checker.get_legal_moves()))
-            env.print_game()
-
-            # determine epsilon-greedy action from current state
-            try:
-                action = agent.act(state, epsilon, legal_checker)
-            except ValueError:
-                print("Unwinnable game")
-                break
+        save_agent()
+        return True
+
+    return False
 
-            # if i % 200 == 0:
-            #     env.print_game()
-            #     print(legal_checker.decode_move(action))
 
-            # send the action to the environment and receive resultant environment information
-            # env_info = env.step(action)
-            reward = env.play_move_reward(legal_checker.decode_move(action))
+def record_episode(score, won):
+    """Records an episode played by a VectorEnv or an actor. Returns True if
+    the training is finished."""
+    global i_episode, won_games
 
-            next_state = env.encode_board()  # get the next state
-            # reward = env_info.rewards[0]  # get the reward
-            done = env.check_if_won()  # see if episode has finished
+    i_episode += 1
+    won_games += int(won)
 
-            # Send (S, A, R, S') info to the DQN agent for a neural network update
-            agent.step(state, action, reward, next_state, done)
+    return finish_episode(i_episode, score)
 
-            # set new state to current state for determining next action
-            state = next_state
 
-            # Update episode score
-            score += reward
+try:
+    # create log file
+    timestr = time.strftime("%Y%m%d-%H%M%S")
+    log_file = open(f"score-{timestr}.csv", "w")
 
-            if done:
-                won_games += 1
-                print("Won game")
+    i_episode = 0
+
+    if args.actors > 0:
+        # Actor processes play the episodes, with epsilons of their own, and
+        # this process only trains the network
+        # (with --envs, the number of boards played at once by every actor)
+        actor_learner.train(
+            agent,
+            args.actors,
+            boards,
+            num_episodes,
+            record_episode,
+            args.envs if args.envs > 1 else actor_learner.envs_per_actor,
+        )
+    elif args.envs > 1:
+        # Play args.envs boards at once, with an action for each of them chosen
+        # in a single forward pass
+        envs = VectorEnv(args.envs, boards)
+        finished = False
+
+        while i_episode < num_episodes and not finished:
+            states = envs.observations.copy()
+            actions = agent.act_batch(states, epsilon)
+            next_states, rewards, dones, _ = envs.step(actions)
+
+            # Send the (S, A, R, S') info of every board to the DQN agent
+            agent.step_batch(states, actions, rewards, next_states, dones)
+
+            for score, won in envs.pop_finished():
+                if record_episode(score, won):
+                    finished = True
+                    break
+    else:
+        # loop from num_episodes
+        for i_episode in range(1, num_episodes + 1):
+            # reset the unity environment at the beginning of each episode
+            # env_info = env.reset(train_mode=True)[brain_name]
+            env = (
+                boards[i_episode - 1]
+                if boards is not None
+                else SolitaireBoard.generate_random()
+            )
+            legal_checker = LegalMoveChecker(env)
+
+            # get initial state of the unity environment
+            # state = env_info.vector_observations[0]
+            legal_moves = legal_checker.get_legal_moves()
+            state = encode_observation(env, legal_moves)
+
+            # set the initial episode score to zero.
+            score = 0
+
+            # Run the episode training loop;
+            # At each loop step take an epsilon-greedy action as a function of the current state observations
+            # Based on the resultant environmental state (next_state) and reward received update the Agent network
+            # If environment episode is done, exit loop...
+            # Otherwise repeat until done == true
+            i = 0
+            while True:
+                # Clear screen (ANSI escape code)
+                print("\033[2J\033[H", end="")
+                print((i, score, legal_moves))
                 env.print_game()
-                break
 
-            # If unity indicates that episode is done,
-            # then exit episode loop, to begin new episode
-            if i > 500:
-                break
+                # determine epsilon-greedy action from current state
+                try:
+                    action = agent.act(state, epsilon)
+                except ValueError:
+                    print("Unwinnable game")
+                    break
 
-            i += 1
+                # if i % 200 == 0:
+                #     env.print_game()
+                #     print(legal_checker.decode_move(action))
 
-        # Add episode score to Scores and...
-        # Calculate mean score over last 100 episodes
-        # Mean score is calculated over current episodes until i_episode > 100
-        scores.append(score)
-        average_score = np.mean(
-            scores[i_episode - min(i_episode, scores_average_window) : i_episode + 1]
-        )
+                # send the action to the environment and receive resultant environment information
+                # env_info = env.step(action)
+                reward = env.play_move_reward(legal_checker.decode_move(action))
 
-        # Decrease epsilon for epsilon-greedy policy by decay rate
-        # Use max method to make sure epsilon doesn't decrease below epsilon_min
-        epsilon = max(epsilon_min, epsilon_decay * epsilon)
+                legal_moves = legal_checker.get_legal_moves()
+                next_state = encode_observation(env, legal_moves)  # get the next state
+                # reward = env_info.rewards[0]  # get the reward
+                done = env.check_if_won()  # see if episode has finished
 
-        # (Over-) Print current average score
-        print(
-            "{},{:.2f},{:.2f}".format(i_episode, average_score, won_games / i_episode)
-        )
+                # Send (S, A, R, S') info to the DQN agent for a neural network update
+                agent.step(state, action, reward, next_state, done)
 
-        # Write to log file
-        log_file.write(
-            "{},{:.2f},{:.2f}\n".format(i_episode, average_score, won_games / i_episode)
-        )
+                # set new state to current state for determining next action
+                state = next_state
 
-        # Flush log file
-        log_file.flush()
+                # Update episode score
+                score += reward
 
-        # Check to see if the task is solved (i.e,. avearge_score > solved_score).
-        # If yes, save the network weights and scores and end training.
-        if won_games / i_episode > 0.75:
-            print(
-                "\nEnvironment solved in {:d} episodes!\tAverage Score: {:.2f}".format(
-                    i_episode, average_score
-                )
-            )
+                if done:
+                    won_games += 1
+                    print("Won game")
+                    env.print_game()
+                    break
+
+                # If unity indicates that episode is done,
+                # then exit episode loop, to begin new episode
+                if i > 500:
+                    break
 
-            # Save trained neural network weights
-            timestr = time.strftime("%Y%m%d-%H%M%S")
-            nn_filename = "dqnAgent_Trained_Model_" + timestr + ".pth"
-            torch.save(agent.network.state_dict(), nn_filename)
+                i += 1
 
-            # Save the recorded Scores data
-            scores_filename = "dqnAgent_scores_" + timestr + ".csv"
-            np.savetxt(scores_filename, scores, delimiter=",")
-            break
+            if finish_episode(i_episode, score):
+                break
 except KeyboardInterrupt:
     print("\nEnvironment solved")
-
-    # Save trained neural network weights
-    timestr = time.strftime("%Y%m%d-%H%M%S")
-    nn_filename = "dqnAgent_Trained_Model_" + timestr + ".pth"
-    torch.save(agent.network.state_dict(), nn_filename)
-
-    # Save the recorded Scores data
-    scores_filename = "dqnAgent_scores_" + timestr + ".csv"
-    np.savetxt(scores_filename, scores, delimiter=",")
+    save_agent()
 
 """
 ###################################
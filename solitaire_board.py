@@ -25,6 +25,19 @@ import numpy as np
 # TODO: Make class immutable (create a new instance every time a move is made)
 # TODO: Check if there are no more moves available
 
+MASK_64 = 0xFFFFFFFFFFFFFFFF
+
+
+def splitmix64(state: int):
+    """Advances a SplitMix64 generator, returning its new state and the next
+    64-bit output."""
+    state = (state + 0x9E3779B97F4A7C15) & MASK_64
+    z = state
+    z = ((z ^ (z >> 30)) * 0xBF58476D1CE4E5B9) & MASK_64
+    z = ((z ^ (z >> 27)) * 0x94D049BB133111EB) & MASK_64
+
+    return state, z ^ (z >> 31)
+
 
 class SolitaireBoard:
     @staticmethod
@@ -33,6 +46,31 @@ class SolitaireBoard:
         cards = [Card(n, s) for s in Card.suits for n in Card.numbers]
         shuffle(cards)
 
+        return SolitaireBoard.deal(cards)
+
+    @staticmethod
+    def generate_from_number(number: int):
+        """Generate the solitaire board with the given deal number, between 0
+        and 2**64 - 1. The deck is shuffled with a SplitMix64 generator seeded
+        with the number, so a deal number gives the same board on every
+        machine and version of Python."""
+        if number < 0 or number > MASK_64:
+            raise ValueError(f"Invalid deal number {number}")
+
+        cards = [Card(n, s) for s in Card.suits for n in Card.numbers]
+
+        # Fisher-Yates shuffle
+        state = number
+        for i in range(len(cards) - 1, 0, -1):
+            state, value = splitmix64(state)
+            j = value % (i + 1)
+            cards[i], cards[j] = cards[j], cards[i]
+
+        return SolitaireBoard.deal(cards)
+
+    @staticmethod
+    def deal(cards: list[Card]):
+        """Generate a solitaire board by dealing the given (shuffled) deck."""
         tableau: list[list[Card]] = [[], [], [], [], [], [], []]
         foundations: dict[str, list[Card]] = {"C": [], "S": [], "H": [], "D": []}
         stock: list[Card] = []
@@ -73,6 +111,32 @@ class SolitaireBoard:
 
         return SolitaireBoard(tableau, foundations, stock, waste)  # type: ignore
 
+    @staticmethod
+    def generate_from_compact(data: bytes):
+        """Generate a solitaire board from the compact representation returned
+        by `export_compact`."""
+
+        pos = 0
+
+        def read_pile():
+            nonlocal pos
+            length = data[pos]
+            pile = [Card.from_compact(i) for i in data[pos + 1 : pos + 1 + length]]
+            pos += 1 + length
+            return pile
+
+        stock = read_pile()
+        waste = read_pile()
+
+        foundations = {}
+        for suit in Card.suits:
+            foundations[suit] = [Card(n, suit) for n in Card.numbers[: data[pos]]]
+            pos += 1
+
+        tableau = [read_pile() for _ in range(7)]
+
+        return SolitaireBoard(tableau, foundations, stock, waste)
+
     def __init__(
         self,
         tableau: list[list[Card]],
@@ -88,6 +152,23 @@ class SolitaireBoard:
         self.consecutive_d_count = 0
         self.last_m_moves = []
 
+    def __deepcopy__(self, memo):
+        """Copies the board and its cards. Only the cards are mutable, so this
+        is equivalent to, and much faster than, the generic `deepcopy`."""
+        board = SolitaireBoard(
+            [[card.copy() for card in col] for col in self.tableau],
+            {
+                suit: [card.copy() for card in pile]
+                for suit, pile in self.foundations.items()
+            },
+            [card.copy() for card in self.stock],
+            [card.copy() for card in self.waste],
+        )
+        board.consecutive_d_count = self.consecutive_d_count
+        board.last_m_moves = list(self.last_m_moves)
+
+        return board
+
     def print_game(self):
         """Prints the current state of the game."""
 
@@ -215,6 +296,81 @@ class SolitaireBoard:
 
         return True
 
+    def __check_card_to_tableau(self, card, col):
+        """Checks if the given card can be added to the given column in the
+        tableau."""
+        # If column is empty, only K can be added
+        if len(self.tableau[col]) == 0:
+            if card.number != "K":
+                raise ValueError(f"Invalid card {card}")
+        else:
+            # If column is not empty, the card must be next in order
+            last_card = self.tableau[col][-1]
+
+            if last_card.color() == card.color():
+                raise ValueError(f"Invalid card {card} (colors must alternate)")
+
+            if not last_card.is_right_next(card):
+                raise ValueError(f"Invalid card {card} (not in descending order)")
+
+    def can_move_within_tableau(self, from_col, to_col, size=1):
+        """Returns whether `move_within_tableau` would succeed, without changing
+        the board."""
+        try:
+            self.__check_tableau_range(from_col, to_col, size)
+        except ValueError:
+            return False
+
+        return True
+
+    def can_move_to_foundation(self, col):
+        """Returns whether `move_to_foundation` would succeed, without changing
+        the board."""
+        if len(self.tableau[col]) == 0:
+            return False
+
+        try:
+            return self.__check_card_to_foundation(self.tableau[col][-1])
+        except ValueError:
+            return False
+
+    def can_move_from_waste(self, col):
+        """Returns whether `move_from_waste` would succeed, without changing
+        the board."""
+        if len(self.waste) == 0:
+            return False
+
+        try:
+            self.__check_card_to_tableau(self.waste[-1], col)
+        except ValueError:
+            return False
+
+        return True
+
+    def can_move_from_waste_to_foundation(self):
+        """Returns whether `move_from_waste_to_foundation` would succeed,
+        without changing the board."""
+        if len(self.waste) == 0:
+            return False
+
+        try:
+            return self.__check_card_to_foundation(self.waste[-1])
+        except ValueError:
+            return False
+
+    def can_move_from_foundation_to_tableau(self, suit, col):
+        """Returns whether `move_from_foundation_to_tableau` would succeed,
+        without changing the board."""
+        if len(self.foundations[suit]) == 0:
+            return False
+
+        try:
+            self.__check_card_to_tableau(self.foundations[suit][-1], col)
+        except ValueError:
+            return False
+
+        return True
+
     def move_within_tableau(self, from_col, to_col, size=1):
         """Moves the given number of cards from one column to another in the
         tableau."""
@@ -258,22 +414,7 @@ class SolitaireBoard:
         if len(self.waste) == 0:
             raise ValueError("Waste is empty")
 
-        card = self.waste[-1]
-
-        # If column is empty, only K can be added
-        if len(self.tableau[col]) == 0:
-            if card.number != "K":
-                raise ValueError(f"Invalid card {card}")
-
-        # If column is not empty, the card must be next in order
-        if len(self.tableau[col]) > 0:
-            last_card = self.tableau[col][-1]
-
-            if last_card.color() == card.color():
-                raise ValueError(f"Invalid card {card} (colors must alternate)")
-
-            if not last_card.is_right_next(card):
-                raise ValueError(f"Invalid card {card} (not in descending order)")
+        self.__check_card_to_tableau(self.waste[-1], col)
 
         self.tableau[col].append(self.waste.pop())
 
@@ -294,20 +435,7 @@ class SolitaireBoard:
         if len(self.foundations[suit]) == 0:
             raise ValueError(f"Foundation {suit} is empty")
 
-        card = self.foundations[suit][-1]
-
-        # If column is empty, only K can be added
-        if len(self.tableau[col]) == 0:
-            if card.number != "K":
-                raise ValueError(f"Invalid card {card}")
-        else:
-            # If column is not empty, the card must be next in order
-            last_card = self.tableau[col][-1]
-            if last_card.color() == card.color():
-                raise ValueError(f"Invalid card {card} (colors must alternate)")
-
-            if not last_card.is_right_next(card):
-                raise ValueError(f"Invalid card {card} (not in descending order)")
+        self.__check_card_to_tableau(self.foundations[suit][-1], col)
 
         self.tableau[col].append(self.foundations[suit].pop())
 
@@ -487,6 +615,27 @@ class SolitaireBoard:
 
         return ret
 
+    def export_compact(self):
+        """Exports the state of the game to a compact byte string. Every pile
+        is stored as its length followed by the compact value of each card
+        (see `Card.compact`), except for the foundations, which only need their
+        lengths. The result is at most 66 bytes long."""
+
+        ret = bytearray()
+
+        for pile in (self.stock, self.waste):
+            ret.append(len(pile))
+            ret.extend(i.compact() for i in pile)
+
+        for suit in Card.suits:
+            ret.append(len(self.foundations[suit]))
+
+        for col in self.tableau:
+            ret.append(len(col))
+            ret.extend(i.compact() for i in col)
+
+        return bytes(ret)
+
     def encode_board(self):
         """Encodes the state of the board as a one-hot vector, to be used as
         input to the neural network."""
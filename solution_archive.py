@@ -0,0 +1,124 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import fcntl
+import hashlib
+import json
+import os
+import struct
+from solitaire_board import SolitaireBoard
+
+"""
+Append-only archive of solutions. Every solution is a JSON line with the
+initial board (in the format of `SolitaireBoard.export`), the moves that solve
+it and the hash of the deal. Next to the archive, an index file holds one
+fixed-size record per solution (the hash of the deal, and the offset and length
+of its line), so solutions can be looked up without parsing the whole archive.
+
+Appends take an exclusive lock on the archive, so many processes can append to
+the same archive at once without overwriting or interleaving their records.
+"""
+
+# Deal hash, offset of the line in the archive and length of the line
+INDEX_RECORD = struct.Struct("<16sQI")
+
+
+def deal_hash(board: SolitaireBoard):
+    """Returns a 16-byte hash identifying the given board."""
+    return hashlib.blake2b(board.export_compact(), digest_size=16).digest()
+
+
+class SolutionArchive:
+    def __init__(self, path: str):
+        """Opens the archive at the given path (a JSONL file). The index is
+        stored in the same path with an `.idx` suffix. Both files are created
+        on the first append."""
+        self.path = path
+        self.index_path = path + ".idx"
+
+    def append(self, board: SolitaireBoard, moves: list):
+        """Appends the solution of the given board to the archive."""
+        key = deal_hash(board)
+
+        record = board.export()
+        record["hash"] = key.hex()
+        record["moves"] = moves
+        line = (json.dumps(record) + "\n").encode()
+
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+
+        with open(self.path, "ab") as f:
+            fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                offset = f.seek(0, os.SEEK_END)
+                f.write(line)
+                f.flush()
+
+                with open(self.index_path, "ab") as index:
+                    index.write(INDEX_RECORD.pack(key, offset, len(line)))
+            finally:
+                fcntl.flock(f, fcntl.LOCK_UN)
+
+    def __iter__(self):
+        """Yields every solution of the archive, in the order they were
+        appended."""
+        if not os.path.exists(self.path):
+            return
+
+        with open(self.path, "rb") as f:
+            for line in f:
+                yield json.loads(line)
+
+    def index(self):
+        """Returns a dictionary from the hash of every deal in the archive to
+        the offsets and lengths of its solutions."""
+        ret = {}
+        if not os.path.exists(self.index_path):
+            return ret
+
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+
+        # A record may be incomplete if a process was killed while appending
+        end = len(data) - len(data) % INDEX_RECORD.size
+        for key, offset, length in INDEX_RECORD.iter_unpack(data[:end]):
+            ret.setdefault(key, []).append((offset, length))
+
+        return ret
+
+    def find(self, key: bytes | str | SolitaireBoard):
+        """Returns the solutions of the given deal, given either as a board or
+        as its hash (raw or in hexadecimal)."""
+        if isinstance(key, SolitaireBoard):
+            key = deal_hash(key)
+        elif isinstance(key, str):
+            key = bytes.fromhex(key)
+
+        locations = self.index().get(key, [])
+        ret = []
+        if not locations:
+            return ret
+
+        with open(self.path, "rb") as f:
+            for offset, length in locations:
+                f.seek(offset)
+                ret.append(json.loads(f.read(length)))
+
+        return ret
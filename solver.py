@@ -0,0 +1,176 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import asyncio
+import random
+import time
+from dataclasses import dataclass, field
+from typing import Callable
+from solitaire_board import SolitaireBoard
+from dfs import dfs_search
+from bfs import bfs_search
+from mcts import mcts_search
+from beam import beam_search
+
+"""
+Library interface to the solvers. `solve` runs one of them on a board and
+returns a `SolveResult`, without printing anything or writing any file; output
+is left to the optional callbacks of the `SolveConfig`.
+"""
+
+solvers = ["dfs", "bfs", "mcts", "beam", "guided"]
+
+
+@dataclass
+class SolveConfig:
+    """Parameters of a `solve` call. Only the parameters of the selected
+    solver are used."""
+
+    solver: str = "dfs"
+    # Seed of the random number generator of the search (used by dfs and mcts;
+    # the global generator of `random` is used if not set)
+    seed: int | None = None
+
+    # dfs, guided and bfs
+    max_nodes: int = 10_000
+    max_depth: int = 150
+
+    # bfs
+    workdir: str | None = None
+    run_size: int = 1_000_000
+
+    # mcts
+    time_budget: float = 10.0
+    exploration: float = 1.4
+    rollouts_per_leaf: int = 8
+    max_playout: int = 200
+
+    # beam
+    beam_width: int = 1000
+    beam_max_depth: int = 300
+
+    # guided
+    model: str | None = None
+    batch_size: int = 64
+    top_k: int | None = None
+
+    # Called with the number of nodes and the current board while searching
+    on_progress: Callable[[int, SolitaireBoard], None] | None = None
+    # Called with the initial board and the moves of the solution, if found
+    on_solution: Callable[[SolitaireBoard, list], None] | None = None
+
+
+@dataclass
+class SolveResult:
+    """Result of a `solve` call. `moves` holds the solution if `solved` is set;
+    otherwise it is empty, except for mcts, where it holds the best line
+    found."""
+
+    solver: str
+    solved: bool
+    moves: list = field(default_factory=list)
+    nodes: int = 0
+    elapsed: float = 0.0
+
+    @property
+    def nodes_per_second(self):
+        return self.nodes / self.elapsed if self.elapsed > 0 else 0.0
+
+
+def solve(board: SolitaireBoard, config: SolveConfig | None = None):
+    """Solves the given board with the solver selected in `config`, returning a
+    `SolveResult`."""
+    if config is None:
+        config = SolveConfig()
+
+    if config.solver not in solvers:
+        raise ValueError(f"Invalid solver {config.solver}")
+
+    rng = random.Random(config.seed) if config.seed is not None else None
+
+    start = time.perf_counter()
+
+    if config.solver == "bfs":
+        moves, nodes = bfs_search(
+            board, config.max_depth, config.workdir, config.run_size, config.on_progress
+        )
+        solved = moves is not None
+    elif config.solver == "mcts":
+        moves, score, nodes = mcts_search(
+            board,
+            config.time_budget,
+            config.exploration,
+            config.rollouts_per_leaf,
+            config.max_playout,
+            on_progress=config.on_progress,
+            rng=rng,
+        )
+        solved = score == 1
+    elif config.solver == "beam":
+        moves, nodes = beam_search(
+            board,
+            config.beam_width,
+            config.beam_max_depth,
+            on_progress=config.on_progress,
+        )
+        solved = moves is not None
+    elif config.solver == "guided":
+        # Imported here so that PyTorch is only needed by this solver
+        from guided_dfs import guided_dfs_search, load_network
+
+        if config.model is None:
+            raise ValueError("The guided solver needs a model")
+
+        moves, nodes = guided_dfs_search(
+            board,
+            load_network(config.model),
+            config.max_nodes,
+            config.max_depth,
+            config.batch_size,
+            config.top_k,
+            config.on_progress,
+        )
+        solved = moves is not None
+    else:
+        moves, nodes = dfs_search(
+            board, config.max_nodes, config.max_depth, config.on_progress, rng=rng
+        )
+        solved = moves is not None
+
+    result = SolveResult(
+        config.solver,
+        solved,
+        moves if moves is not None else [],
+        nodes,
+        time.perf_counter() - start,
+    )
+
+    if solved and config.on_solution is not None:
+        config.on_solution(board, result.moves)
+
+    return result
+
+
+async def solve_async(
+    board: SolitaireBoard, config: SolveConfig | None = None, executor=None
+):
+    """Runs `solve` in an executor (the default one of the event loop if none
+    is given), so it can be awaited without blocking the loop. With a process
+    pool executor, the callbacks of `config` must be picklable."""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, solve, board, config)
@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+import argparse
+import dataclasses
+import json
+import os
+import urllib.request
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from solitaire_board import SolitaireBoard
+from solver import SolveConfig, solve
+
+"""
+This script runs a local HTTP server that keeps a pool of warm solver
+processes, so that solving a board doesn't pay for starting Python, importing
+the solvers and creating the pool every time.
+
+Boards are sent with `POST /solve`, as a JSON object with a list of boards (in
+the format of `SolitaireBoard.export`) and, optionally, the fields of a
+`SolveConfig` (without the callbacks, and without `model` and `workdir`,
+which name files on the server and are set by its command line):
+
+    {"boards": [...], "config": {"solver": "beam", "beam_width": 500}}
+
+All the boards of a request are solved in parallel, and the results are
+streamed back as JSON lines as soon as each one finishes. Every line holds the
+index of the board in the request and the fields of its `SolveResult`.
+`dfs_solver.py --server <url>` acts as a client of this server.
+"""
+
+host = "127.0.0.1"
+port = 8765
+n_workers = os.cpu_count() or 1
+
+# Fields of SolveConfig that can be set by a request. The model is loaded
+# with `torch.load` (which unpickles it) and the bfs solver creates its work
+# directory, so paths are only taken from the command line of the server
+config_fields = {
+    field.name
+    for field in dataclasses.fields(SolveConfig)
+    if field.name not in ("on_progress", "on_solution", "model", "workdir")
+}
+
+
+def make_config(config_json: dict, model: str | None, workdir: str | None):
+    """Builds a SolveConfig from the `config` object of a request and the
+    paths given to the server."""
+    if not isinstance(config_json, dict):
+        raise ValueError("config must be an object")
+
+    invalid = set(config_json) - config_fields
+    if invalid:
+        raise ValueError(f"Invalid config fields {sorted(invalid)}")
+
+    return SolveConfig(**config_json, model=model, workdir=workdir)
+
+
+def solve_json(board_json: dict, config: SolveConfig):
+    """Solves a board given in the format of `SolitaireBoard.export`, returning
+    the result as a dictionary. Runs in the worker processes."""
+    board = SolitaireBoard.generate_from_json(board_json)
+    return dataclasses.asdict(solve(board, config))
+
+
+def warm_up():
+    """Does nothing. Submitted once per worker at start-up, so that the pool
+    processes are created before the first request arrives."""
+    return os.getpid()
+
+
+class SolverRequestHandler(BaseHTTPRequestHandler):
+    # Set by `main`
+    executor: ProcessPoolExecutor
+    workers: int
+    model: str | None
+    workdir: str | None
+
+    def send_json(self, code, data):
+        body = json.dumps(data).encode()
+
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path != "/health":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        self.send_json(200, {"workers": self.workers})
+
+    def do_POST(self):
+        if self.path != "/solve":
+            self.send_json(404, {"error": "Not found"})
+            return
+
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length))
+            boards = request["boards"]
+            if not isinstance(boards, list):
+                raise ValueError("boards must be a list")
+
+            config = make_config(request.get("config", {}), self.model, self.workdir)
+        except (ValueError, KeyError, TypeError) as e:
+            self.send_json(400, {"error": str(e)})
+            return
+
+        futures = {
+            self.executor.submit(solve_json, board_json, config): index
+            for index, board_json in enumerate(boards)
+        }
+
+        # The length of the response is unknown, so the connection is closed
+        # once every result has been sent
+        self.send_response(200)
+        self.send_header("Content-Type", "application/x-ndjson")
+        self.send_header("Connection", "close")
+        self.end_headers()
+
+        for future in as_completed(futures):
+            line = {"index": futures[future]}
+            try:
+                line.update(future.result())
+            except Exception as e:
+                line["error"] = str(e)
+
+            self.wfile.write(json.dumps(line).encode() + b"\n")
+            self.wfile.flush()
+
+        self.close_connection = True
+
+
+def request_solve(url: str, boards: list[dict], config: dict | None = None):
+    """Sends boards (in the format of `SolitaireBoard.export`) to a running
+    server, yielding each result as soon as it arrives."""
+    body = json.dumps({"boards": boards, "config": config or {}}).encode()
+    request = urllib.request.Request(
+        url.rstrip("/") + "/solve",
+        data=body,
+        headers={"Content-Type": "application/json"},
+    )
+
+    with urllib.request.urlopen(request) as response:
+        for line in response:
+            yield json.loads(line)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Runs a local solver server")
+    parser.add_argument("--host", default=host)
+    parser.add_argument("--port", type=int, default=port)
+    parser.add_argument("--workers", type=int, default=n_workers)
+    parser.add_argument(
+        "--model",
+        default=None,
+        help="PTH file generated by rl_train.py, used by the guided solver",
+    )
+    parser.add_argument(
+        "--workdir",
+        default=None,
+        help="directory where the bfs solver stores its layers",
+    )
+    args = parser.parse_args()
+
+    with ProcessPoolExecutor(args.workers) as executor:
+        for future in [executor.submit(warm_up) for _ in range(args.workers)]:
+            future.result()
+
+        SolverRequestHandler.executor = executor
+        SolverRequestHandler.workers = args.workers
+        SolverRequestHandler.model = args.model
+        SolverRequestHandler.workdir = args.workdir
+        server = ThreadingHTTPServer((args.host, args.port), SolverRequestHandler)
+
+        print(f"Listening on http://{args.host}:{args.port}/")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,124 @@
+"""
+solitario_ia
+Copyright (C) 2023 Aníbal Ibaceta, Sebastián Hevia & Jorge Jara
+
+This program is free software: you can redistribute it and/or modify
+it under the terms of the GNU General Public License as published by
+the Free Software Foundation, either version 3 of the License, or
+(at your option) any later version.
+
+This program is distributed in the hope that it will be useful,
+but WITHOUT ANY WARRANTY; without even the implied warranty of
+MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+GNU General Public License for more details.
+
+You should have received a copy of the GNU General Public License
+along with this program.  If not, see <http://www.gnu.org/licenses/>.
+"""
+
+from copy import deepcopy
+import numpy as np
+from legal_moves import LegalMoveChecker
+from observation import OBSERVATION_SIZE, decode_legal_masks, encode_observation
+from solitaire_board import SolitaireBoard
+
+"""
+Environment playing several boards at once, so the agent can choose the moves
+of all of them with a single forward pass of its network (see
+`Agent.act_batch`). Observations, rewards and episode ends are returned as
+arrays with a row per board, and the boards whose episode ended are replaced by
+new deals right away.
+"""
+
+# Moves after which an episode is ended
+max_episode_steps = 500
+
+
+class VectorEnv:
+    def __init__(self, n_envs: int, boards=None, max_steps: int = max_episode_steps):
+        """Creates an environment with `n_envs` boards. New episodes are played
+        on the given boards in order (starting over after the last one), or on
+        random deals if no boards are given."""
+        self.n_envs = n_envs
+        self.boards = boards
+        self.max_steps = max_steps
+        self.next_deal = 0
+
+        self.envs = [None] * n_envs
+        self.steps = np.zeros(n_envs, dtype=np.int64)
+        self.scores = np.zeros(n_envs, dtype=np.float64)
+
+        # Current observation of every board, used to choose the next moves
+        self.observations = np.zeros((n_envs, OBSERVATION_SIZE), dtype=np.uint8)
+
+        # Score and result of the episodes ended since the last call to
+        # `pop_finished`
+        self.finished = []
+
+        for i in range(n_envs):
+            self.reset(i)
+
+    def new_board(self):
+        if self.boards is None:
+            return SolitaireBoard.generate_random()
+
+        # The boards are copied, as they may be played more than once
+        board = deepcopy(self.boards[self.next_deal % len(self.boards)])
+        self.next_deal += 1
+
+        return board
+
+    def reset(self, i: int):
+        """Starts a new episode on the i-th board."""
+        self.envs[i] = self.new_board()
+        self.steps[i] = 0
+        self.scores[i] = 0
+        self.observations[i] = encode_observation(self.envs[i])
+
+    @property
+    def legal_masks(self):
+        """Legal moves of the current observations, as boolean masks over the
+        action table."""
+        return decode_legal_masks(self.observations)
+
+    def step(self, actions):
+        """Plays the given action (an index in the action table) on every
+        board. Returns the observations after the moves, the rewards, whether
+        each board was won and whether its episode ended (won, out of moves or
+        out of legal moves). Boards whose episode ended are reset, so their
+        current observation is the one of a new deal."""
+        next_observations = np.zeros_like(self.observations)
+        rewards = np.zeros(self.n_envs, dtype=np.float32)
+        dones = np.zeros(self.n_envs, dtype=bool)
+        ended = np.zeros(self.n_envs, dtype=bool)
+
+        for i, action in enumerate(actions):
+            env = self.envs[i]
+
+            move = LegalMoveChecker.action_table[action]
+            rewards[i] = env.play_move_reward(move)
+            self.scores[i] += rewards[i]
+            self.steps[i] += 1
+
+            legal_moves = LegalMoveChecker(env).get_legal_moves()
+            next_observations[i] = encode_observation(env, legal_moves)
+            dones[i] = env.check_if_won()
+            ended[i] = (
+                dones[i] or self.steps[i] >= self.max_steps or len(legal_moves) == 0
+            )
+
+            if ended[i]:
+                self.finished.append((self.scores[i], dones[i]))
+                self.reset(i)
+            else:
+                self.observations[i] = next_observations[i]
+
+        return next_observations, rewards, dones, ended
+
+    def pop_finished(self):
+        """Returns the score and result (won or not) of the episodes ended
+        since the last call."""
+        ret = self.finished
+        self.finished = []
+
+        return ret
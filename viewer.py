@@ -21,12 +21,14 @@ along with this program.  If not, see <http://www.gnu.org/licenses/>.
 import json
 import sys
 from solitaire_board import SolitaireBoard
+from solution_archive import SolutionArchive
 
 """
 This script is used to view the moves generated by the solver. It takes a single
 argument, which is the path to a JSON file containing the board state and the
 moves to make. The JSON file should be in the same format as the output of
-solver.py.
+solver.py. A solution can also be read from a solution archive (see
+solution_archive.py), by giving the archive and the hash of the deal.
 
 The moves are printed to the screen one at a time, and the user must press enter
 to see the next move. This allows the user to see the moves being made and
@@ -36,14 +38,22 @@ understand how the solver works.
 
 def main():
     if len(sys.argv) < 2:
-        print(f"Usage: {sys.argv[0]} <board_file>", file=sys.stderr)
+        print(f"Usage: {sys.argv[0]} <board_file> | <archive> <hash>", file=sys.stderr)
         sys.exit(1)
 
     board_json = None
 
-    with open(sys.argv[1], "r") as f:
-        board_json = f.read()
-        board_json = json.loads(board_json)
+    if len(sys.argv) > 2:
+        solutions = SolutionArchive(sys.argv[1]).find(sys.argv[2])
+        if len(solutions) == 0:
+            print(f"No solution found for {sys.argv[2]}", file=sys.stderr)
+            sys.exit(1)
+
+        board_json = solutions[0]
+    else:
+        with open(sys.argv[1], "r") as f:
+            board_json = f.read()
+            board_json = json.loads(board_json)
 
     board = SolitaireBoard.generate_from_json(board_json)
 